@@ -0,0 +1,98 @@
+"""
+Aggregates
+----------
+
+Extra subtree aggregates that a `tree.Tree` can keep up to date next to
+`subtree_value`. An aggregate is an associative, commutative way of
+combining the keys of a subtree, described by:
+
+    - lift(key): the value of a single node on its own,
+    - combine(a, b): merges two values,
+    - identity: the value of an empty set of nodes,
+    - inverse(a) (optional): undoes `a`, so that a change below a node can be
+      applied as a difference instead of recomputing from the children.
+
+Aggregates with an inverse (sum, count) are updated in O(1) per ancestor.
+Aggregates without one (min, max) also just combine in the value of a
+subtree that is added, but are recomputed from the children when nodes are
+removed or a key changes. Either way the walk stops once they stop
+changing.
+
+Usage:
+    tree.register_aggregate(aggregates.MIN)
+    tree.aggregate(node, "min")
+"""
+from functools import reduce
+import heapq
+from itertools import islice
+
+
+class Aggregate:
+    """
+    Aggregate Class
+    Describes one aggregate. See the module docstring for the fields.
+    """
+
+    def __init__(self, name, lift, combine, identity, inverse=None):
+        """
+        :param name: Name used to look the value up.
+        :param lift: Function from a key to a value.
+        :param combine: Associative, commutative function of two values.
+        :param identity: Value with combine(identity, a) == a.
+        :param inverse: Optional function with combine(a, inverse(a)) ==
+            identity.
+        """
+        self.name = name
+        self.lift = lift
+        self.combine = combine
+        self.identity = identity
+        self.inverse = inverse
+
+    def __repr__(self):
+        return "Aggregate({!r})".format(self.name)
+
+    def of_node(self, node):
+        """
+        Computes the value of `node` from its key and its children's values.
+        :param node: The node, whose children are already up to date.
+        """
+        name = self.name
+        return reduce(self.combine,
+                      (c.aggregates[name] for c in node.children),
+                      self.lift(node.key))
+
+    def difference(self, new, old):
+        """
+        The change that turns `old` into `new`; needs an inverse.
+        """
+        return self.combine(new, self.inverse(old))
+
+
+class TopK(Aggregate):
+    """
+    TopK Class
+    The `k` largest keys of a subtree, largest first, as a tuple. Merging
+    two of them takes O(k). Once registered, `Tree.top_k` reads it for any
+    count up to `k`.
+    """
+
+    def __init__(self, k):
+        """
+        :param k: How many keys to keep per node.
+        """
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        self.k = k
+        super().__init__("top{}".format(k), lambda key: (key,),
+                         self._merge, ())
+
+    def _merge(self, a, b):
+        return tuple(islice(heapq.merge(a, b, reverse=True), self.k))
+
+
+MAX = Aggregate("max", lambda key: key, max, float("-inf"))
+MIN = Aggregate("min", lambda key: key, min, float("inf"))
+SUM = Aggregate("sum", lambda key: key, lambda a, b: a + b, 0,
+                inverse=lambda a: -a)
+COUNT = Aggregate("count", lambda key: 1, lambda a, b: a + b, 0,
+                  inverse=lambda a: -a)
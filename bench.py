@@ -0,0 +1,391 @@
+"""
+Benchmarks
+----------
+
+Times put, flatten and swap on generated trees of several shapes and sizes,
+for `tree.py`/`node.py` and for the reference `treesol.py`/`nodesol.py`,
+and writes the results to JSON so runs can be compared.
+
+Shapes (see `SHAPES`), all with random keys:
+
+    chain        every node under the one before it
+    star         every node under the root
+    kary         complete k-ary tree (binary by default)
+    random       random recursive tree: each node under a random earlier one
+    caterpillar  a chain with one leaf hanging off each spine node
+
+Each operation is measured on a freshly built tree, three times over:
+once timed, once under `tracemalloc` for the peak memory it allocates, and
+once counting the distinct `Node` objects it reads or writes, which is how
+far each update walks. Puts add a leaf under a random node, swaps exchange
+two random leaves (which are never related), and flattens remove random
+subtrees, deepest first so that every target is still in the tree.
+
+`swap_subtrees` exchanges two children of the same node, whole subtrees of
+every size: the parent is picked at a random depth, so subtrees near the
+root, holding a good part of the tree, come up as often as small ones near
+the leaves. Swapping siblings never makes two nodes related, so the pairs
+stay valid however many are applied. This shows whether a swap costs the
+size of the subtrees it moves.
+
+Work done once on first use, such as the Euler tour behind
+`Tree.is_ancestor` or the child heap of a wide node, is part of the time
+and of the mean visits; the median visits show the typical operation.
+
+The reference flattens and propagates recursively, so on deep trees it
+stops with a RecursionError; that is recorded as the error of the result.
+
+For each implementation, shape and operation measured at two or more sizes,
+`summary` fits the exponent of n in the time and in the median nodes
+visited per operation: about 0 for O(1) or O(log n) work, about 1 for O(n).
+
+The default sizes go up to 10**7 nodes, which takes a long time (and
+several GB) for the slow combinations; pass `--sizes` to stop earlier.
+
+Usage:
+    python bench.py --sizes 1000 10000 100000 --out bench.json
+
+    results = run(sizes=[1000], shapes=["chain"], ops=["put"])
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import node
+import nodesol
+import tree
+import treesol
+
+SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+OPS = ["put", "flatten", "swap", "swap_subtrees"]
+COUNT = 1000
+VISIT_COUNT = 100
+
+
+def chain(n, rng):
+    return [-1] + list(range(n - 1))
+
+
+def star(n, rng):
+    return [-1] + [0] * (n - 1)
+
+
+def kary(n, rng, k=2):
+    return [-1] + [(i - 1) // k for i in range(1, n)]
+
+
+def random_recursive(n, rng):
+    return [-1] + [rng.randrange(i) for i in range(1, n)]
+
+
+def caterpillar(n, rng):
+    spine = (n + 1) // 2
+    return [-1] + list(range(spine - 1)) + list(range(n - spine))
+
+
+# Each generator returns the parent index of every node, with -1 for the
+# root and every parent before its children.
+SHAPES = {
+    "chain": chain,
+    "star": star,
+    "kary": kary,
+    "random": random_recursive,
+    "caterpillar": caterpillar,
+}
+
+
+def build_tree(keys, parents):
+    """
+    Builds a `tree.Tree` like `Tree.from_parent_array`, but also returns the
+    nodes by index.
+    :return: (tree, list of nodes)
+    """
+    nodes = [node.Node(k) for k in keys]
+    for i in range(1, len(nodes)):
+        nodes[parents[i]].link_child(nodes[i])
+    t = tree.Tree(nodes[0])
+    t.recompute_all()
+    return t, nodes
+
+
+def build_treesol(keys, parents):
+    """
+    Builds a reference `treesol.Tree`, filling in the subtree values in one
+    pass from the bottom up.
+    :return: (tree, list of nodes)
+    """
+    nodes = [nodesol.Node(k) for k in keys]
+    for i in range(1, len(nodes)):
+        p = nodes[parents[i]]
+        nodes[i].parent = p
+        p.children.append(nodes[i])
+    for n in reversed(nodes):
+        p = n.parent
+        if p is not None and p.subtree_value < n.subtree_value:
+            p.subtree_value = n.subtree_value
+    return treesol.Tree(nodes[0]), nodes
+
+
+# The implementations compared: how to build one, and its node class.
+IMPLEMENTATIONS = {
+    "tree": (build_tree, node.Node),
+    "treesol": (build_treesol, nodesol.Node),
+}
+
+
+def plan(op, parents, count, rng):
+    """
+    Picks the arguments of `count` operations on a tree of the given shape.
+    Fewer are returned if the tree does not have enough leaves to swap,
+    nodes with two children to swap below, or nodes to flatten.
+    :return: List of argument tuples, of node indices (or keys, for put).
+    """
+    n = len(parents)
+    if op == "put":
+        return [(rng.randrange(n), rng.randint(0, 10 ** 6))
+                for _ in range(count)]
+    if op == "flatten":
+        targets = rng.sample(range(1, n), min(count, n - 1))
+        # A node's descendants have larger indices, so flattening from the
+        # largest index down never picks a node that is already gone.
+        return [(i,) for i in sorted(targets, reverse=True)]
+    if op == "swap":
+        has_child = set(parents)
+        leaves = [i for i in range(1, n) if i not in has_child]
+        if len(leaves) < 2:
+            return []
+        return [tuple(rng.sample(leaves, 2)) for _ in range(count)]
+    if op == "swap_subtrees":
+        children = {}
+        depths = [0] * n
+        for i in range(1, n):
+            children.setdefault(parents[i], []).append(i)
+            depths[i] = depths[parents[i]] + 1
+        by_depth = {}
+        for p, kids in children.items():
+            if len(kids) >= 2:
+                by_depth.setdefault(depths[p], []).append(p)
+        if not by_depth:
+            return []
+        levels = sorted(by_depth)
+        pairs = []
+        for _ in range(count):
+            p = rng.choice(by_depth[rng.choice(levels)])
+            pairs.append(tuple(rng.sample(children[p], 2)))
+        return pairs
+    raise ValueError("unknown operation: {}".format(op))
+
+
+def apply(t, node_class, nodes, op, args):
+    """
+    Runs the planned operations on a tree built from `nodes`.
+    """
+    if op == "put":
+        put = t.put
+        for i, key in args:
+            put(nodes[i], node_class(key))
+    elif op == "flatten":
+        flatten = t.flatten
+        for i, in args:
+            flatten(nodes[i])
+    else:
+        swap = t.swap
+        for a, b in args:
+            swap(nodes[a], nodes[b])
+
+
+def counting(node_class, visited):
+    """
+    Returns a subclass of `node_class` that adds the id of every instance
+    whose attributes are read or written to `visited`.
+    """
+    def __getattribute__(self, name):
+        visited.add(id(self))
+        return object.__getattribute__(self, name)
+
+    def __setattr__(self, name, value):
+        visited.add(id(self))
+        object.__setattr__(self, name, value)
+
+    return type("Counting" + node_class.__name__, (node_class,), {
+        "__getattribute__": __getattribute__,
+        "__setattr__": __setattr__,
+    })
+
+
+def measure(impl, shape, size, op, count=COUNT, visit_count=VISIT_COUNT,
+            seed=0):
+    """
+    Measures one operation of one implementation on one tree.
+    :param impl: Name in `IMPLEMENTATIONS`.
+    :param shape: Name in `SHAPES`.
+    :param size: Number of nodes in the tree.
+    :param op: One of `OPS`.
+    :param count: Number of operations timed.
+    :param visit_count: Number of operations whose node visits are counted.
+    :param seed: Seed for the shape, keys and targets.
+    :return: dict of the results.
+    """
+    build, node_class = IMPLEMENTATIONS[impl]
+    rng = random.Random(seed)
+    parents = SHAPES[shape](size, rng)
+    keys = [rng.randint(0, 10 ** 6) for _ in range(size)]
+    args = plan(op, parents, count, rng)
+    result = {
+        "impl": impl, "shape": shape, "size": size, "op": op,
+        "ops": len(args), "seconds": None, "ops_per_sec": None,
+        "build_peak_bytes": None, "op_peak_bytes": None,
+        "visits_per_op": None, "visits_median": None, "error": None,
+    }
+
+    try:
+        tracemalloc.start()
+        t, nodes = build(keys, parents)
+        result["build_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        apply(t, node_class, nodes, op, args)
+        seconds = time.perf_counter() - start
+        result["seconds"] = seconds
+        if args and seconds > 0:
+            result["ops_per_sec"] = len(args) / seconds
+        del t, nodes
+
+        t, nodes = build(keys, parents)
+        tracemalloc.start()
+        apply(t, node_class, nodes, op, args)
+        result["op_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del t, nodes
+
+        t, nodes = build(keys, parents)
+        visited = set()
+        counter = counting(node_class, visited)
+        for n in nodes:
+            n.__class__ = counter
+        visits = []
+        for one in args[:visit_count]:
+            visited.clear()
+            apply(t, counter, nodes, op, [one])
+            visits.append(len(visited))
+        if visits:
+            result["visits_per_op"] = sum(visits) / len(visits)
+            result["visits_median"] = statistics.median(visits)
+    except RecursionError:
+        result["error"] = "RecursionError"
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+    return result
+
+
+def fit_exponent(sizes, values):
+    """
+    Fits `values` to c * size ** e by least squares on the logarithms.
+    :return: The exponent e, or None with fewer than two usable points.
+    """
+    points = [(math.log(s), math.log(v)) for s, v in zip(sizes, values)
+              if v is not None and v > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if spread == 0:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def summary(results):
+    """
+    Fits how the time and the visits per operation grow with the size, for
+    each implementation, shape and operation.
+    :param results: List of dicts from `measure`.
+    :return: List of dicts with "time_exponent" and "visits_exponent".
+    """
+    groups = {}
+    for r in results:
+        if r["error"] is None and r["ops"]:
+            groups.setdefault((r["impl"], r["shape"], r["op"]), []).append(r)
+
+    fits = []
+    for (impl, shape, op), rs in sorted(groups.items()):
+        sizes = [r["size"] for r in rs]
+        fits.append({
+            "impl": impl, "shape": shape, "op": op, "sizes": sizes,
+            "time_exponent": fit_exponent(
+                sizes, [r["seconds"] / r["ops"] for r in rs]),
+            "visits_exponent": fit_exponent(
+                sizes, [r["visits_median"] for r in rs]),
+        })
+    return fits
+
+
+def run(sizes=None, shapes=None, ops=None, impls=None, count=COUNT,
+        visit_count=VISIT_COUNT, seed=0, progress=None):
+    """
+    Measures every combination of the given sizes, shapes, operations and
+    implementations (all of them by default).
+    :param progress: If given, called with each result as it is measured.
+    :return: dict with "environment", "results" and "summary", ready for
+        `json.dump`.
+    """
+    results = []
+    for size in sizes or SIZES:
+        for shape in shapes or SHAPES:
+            for op in ops or OPS:
+                for impl in impls or IMPLEMENTATIONS:
+                    r = measure(impl, shape, size, op, count=count,
+                                visit_count=visit_count, seed=seed)
+                    results.append(r)
+                    if progress is not None:
+                        progress(r)
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "seed": seed,
+            "count": count,
+            "visit_count": visit_count,
+        },
+        "results": results,
+        "summary": summary(results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--shapes", nargs="+", choices=list(SHAPES))
+    parser.add_argument("--ops", nargs="+", choices=OPS)
+    parser.add_argument("--impls", nargs="+", choices=list(IMPLEMENTATIONS))
+    parser.add_argument("--count", type=int, default=COUNT)
+    parser.add_argument("--visit-count", type=int, default=VISIT_COUNT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="-",
+                        help="JSON file to write, - for standard output")
+    args = parser.parse_args(argv)
+
+    def progress(r):
+        print("{impl:8} {shape:12} {size:>9} {op:8} {ops_per_sec} {error}"
+              .format(**r), file=sys.stderr)
+
+    report = run(args.sizes, args.shapes, args.ops, args.impls, args.count,
+                 args.visit_count, args.seed, progress)
+    if args.out == "-":
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,595 @@
+"""
+Euler Tour Tree
+---------------
+
+An alternative backend for `tree.Tree`. Every node is written into an Euler
+tour as two tokens: one when the walk enters the node and one when it leaves.
+The subtree of a node is then exactly the run of tokens between its two
+tokens, so moving a subtree is cutting and splicing one run.
+
+The tour is stored in a treap (a binary search tree kept balanced by random
+priorities) ordered by position. Every treap node also stores the max, sum
+and number of nodes of everything below it, so:
+
+    - put, flatten, swap and move are O(log n),
+    - subtree max / sum / size are O(log n),
+
+no matter how deep the tree is.
+
+`TourOrder` keeps only the order of the tour, without the values, so the
+default backend of `tree.Tree` can check ancestors in O(log n) however its
+subtrees are moved around.
+
+Usage:
+    t = tree.Tree(root, backend="euler")
+"""
+import random
+
+
+class Token:
+    """
+    Token Class
+    One entry of the Euler tour, and a node of the treap holding the tour.
+    Open tokens carry the key of their node, close tokens (and the tokens
+    of a `TourOrder`) carry nothing.
+    """
+
+    __slots__ = ("left", "right", "parent", "priority", "node", "key",
+                 "count", "top", "total", "opens")
+
+    def __init__(self, node, key=None):
+        """
+        :param node: The tree node this token belongs to.
+        :param key: The key of the node, for the token entering it.
+        """
+        self.left = None
+        self.right = None
+        self.parent = None
+        self.priority = random.random()
+        self.node = node
+        self.key = key
+        self.count = 1
+        self.top = key
+        self.total = key if key is not None else 0
+        self.opens = 1 if key is not None else 0
+
+    def set_key(self, key):
+        """
+        Changes the key of an open token and fixes the aggregates above it.
+        :param key: The new key.
+        """
+        self.key = key
+        t = self
+        while t is not None:
+            _pull(t)
+            t = t.parent
+
+
+def _pull(t):
+    """
+    Recomputes the aggregates of `t` from its children.
+    """
+    top = t.key
+    if top is None:
+        total = opens = 0
+    else:
+        total = top
+        opens = 1
+    count = 1
+    c = t.left
+    if c is not None:
+        c.parent = t
+        count += c.count
+        total += c.total
+        opens += c.opens
+        if c.top is not None and (top is None or c.top > top):
+            top = c.top
+    c = t.right
+    if c is not None:
+        c.parent = t
+        count += c.count
+        total += c.total
+        opens += c.opens
+        if c.top is not None and (top is None or c.top > top):
+            top = c.top
+    t.count = count
+    t.top = top
+    t.total = total
+    t.opens = opens
+
+
+def _merge(a, b):
+    """
+    Joins two treaps, all of `a` before all of `b`.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _pull(a)
+        return a
+    b.left = _merge(a, b.left)
+    _pull(b)
+    return b
+
+
+def _split(t, k):
+    """
+    Splits a treap into its first `k` tokens and the rest.
+    """
+    if t is None:
+        return None, None
+    left_count = t.left.count if t.left is not None else 0
+    if k <= left_count:
+        a, b = _split(t.left, k)
+        t.left = b
+        _pull(t)
+        if a is not None:
+            a.parent = None
+        return a, t
+    a, b = _split(t.right, k - left_count - 1)
+    t.right = a
+    _pull(t)
+    if b is not None:
+        b.parent = None
+    return t, b
+
+
+def _join(*parts):
+    """
+    Merges the given treaps in order and returns the root.
+    """
+    root = None
+    for part in parts:
+        root = _merge(root, part)
+    if root is not None:
+        root.parent = None
+    return root
+
+
+def _attach(before, part):
+    """
+    Splices the treap `part` into the treap holding token `before`, just
+    before it. `part` goes into the empty slot at that place and is rotated
+    up past lower priorities, which takes O(1) rotations on average, and
+    the tokens above it then just add its aggregates in. This is cheaper
+    than splitting and joining, which redo the aggregates at every level.
+    """
+    count = part.count
+    top = part.top
+    total = part.total
+    opens = part.opens
+
+    t = before.left
+    if t is None:
+        before.left = part
+        t = before
+    else:
+        while t.right is not None:
+            t = t.right
+        t.right = part
+    part.parent = t
+
+    while t is not None and t.priority < part.priority:
+        _rotate_up(part)
+        t = part.parent
+
+    while t is not None:
+        t.count += count
+        t.total += total
+        t.opens += opens
+        if top is not None and (t.top is None or top > t.top):
+            t.top = top
+        t = t.parent
+
+
+def _rotate_up(t):
+    """
+    Rotates token `t` above its parent.
+    """
+    p = t.parent
+    g = p.parent
+    if p.left is t:
+        p.left = t.right
+        t.right = p
+    else:
+        p.right = t.left
+        t.left = p
+    _pull(p)
+    _pull(t)
+    t.parent = g
+    if g is not None:
+        if g.left is p:
+            g.left = t
+        else:
+            g.right = t
+
+
+def _position(t):
+    """
+    Returns the position of token `t` in its tour, and the root of the
+    treap holding it.
+    """
+    pos = t.left.count if t.left is not None else 0
+    while t.parent is not None:
+        p = t.parent
+        if p.right is t:
+            pos += 1 + (p.left.count if p.left is not None else 0)
+        t = p
+    return pos, t
+
+
+def _build(tokens):
+    """
+    Builds a treap from tokens already in tour order, in linear time.
+    """
+    stack = []
+    for t in tokens:
+        last = None
+        while stack and stack[-1].priority < t.priority:
+            last = stack.pop()
+        t.left = last
+        if stack:
+            stack[-1].right = t
+        stack.append(t)
+    if not stack:
+        return None
+
+    root = stack[0]
+    root.parent = None
+
+    # Fix the aggregates bottom up without recursing.
+    order = []
+    todo = [root]
+    while todo:
+        t = todo.pop()
+        order.append(t)
+        if t.left is not None:
+            todo.append(t.left)
+        if t.right is not None:
+            todo.append(t.right)
+    for t in reversed(order):
+        _pull(t)
+    return root
+
+
+class TourOrder:
+    """
+    TourOrder Class
+    Keeps the order of the Euler tour of a tree whose values are kept
+    elsewhere. It never links or unlinks nodes itself: it is told about
+    every change after the tree made it.
+
+    - Init: Writes out the tour of the tree under `root`.
+    - position(node): The place of `node` in the tour.
+    - is_ancestor(a, b): Checks if `a` is a proper ancestor of `b`.
+    - put(node, child): Splices the tour of `child`, new or moved from
+      elsewhere in the tree, in as the last child of `node`.
+    - flatten(node): Cuts out the tours of the nodes below `node`.
+    - forget(node): Drops a node removed from the tree.
+
+    Each of these is O(log n), apart from the nodes a put brings in or a
+    flatten takes out, which cost O(1) each.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: The root node of the tree.
+        """
+        self.tokens = {}
+        self._register(root)
+
+    def _new_tokens(self, node):
+        """
+        Returns the open and close tokens of a node entering the tour.
+        """
+        return Token(node), Token(node)
+
+    def _register(self, top):
+        """
+        Writes the tour of the subtree under `top` and builds its treap.
+        :return: The root of the new treap.
+        """
+        sequence = []
+        stack = [(top, False)]
+        while stack:
+            n, done = stack.pop()
+            if done:
+                sequence.append(self.tokens[n][1])
+                continue
+            tokens = self._new_tokens(n)
+            self.tokens[n] = tokens
+            sequence.append(tokens[0])
+            stack.append((n, True))
+            for c in reversed(n.children):
+                stack.append((c, False))
+        return _build(sequence)
+
+    def _span(self, node):
+        """
+        Returns the positions of both tokens of `node` and the treap root.
+        """
+        opening, closing = self.tokens[node]
+        i, root = _position(opening)
+        j, _ = _position(closing)
+        return i, j, root
+
+    def position(self, node):
+        """
+        Returns the position of `node` in the tour, which orders the nodes
+        of the tree in a DFS order (not always the order of `children`).
+        """
+        return _position(self.tokens[node][0])[0]
+
+    def is_ancestor(self, a, b):
+        """
+        Checks whether `a` is a proper ancestor of `b`.
+        """
+        ai, aj, a_root = self._span(a)
+        bi, bj, b_root = self._span(b)
+        return a_root is b_root and ai < bi and bj < aj
+
+    def forget(self, node):
+        """
+        Drops the tokens of a node that has left the tree for good.
+        """
+        tokens = self.tokens.pop(node, None)
+        if tokens is not None:
+            for t in tokens:
+                t.node = None
+
+    def _cut(self, node):
+        """
+        Removes the tour of `node` from wherever it is.
+        :return: The treap holding just the tour of `node`.
+        """
+        i, j, root = self._span(node)
+        left, rest = _split(root, i)
+        middle, right = _split(rest, j - i + 1)
+        _join(left, right)
+        return middle
+
+    def _insert(self, parent, part):
+        """
+        Splices `part` in as the last child of `parent`.
+        """
+        _attach(self.tokens[parent][1], part)
+
+    def put(self, node, child):
+        """
+        Splices the tour of `child` (and everything below it) in as the last
+        child of `node`. A `child` already in the tour is cut from where it
+        was, so this also moves subtrees.
+        """
+        if child in self.tokens:
+            part = self._cut(child)
+        else:
+            part = self._register(child)
+        self._insert(node, part)
+
+    def flatten(self, node):
+        """
+        Cuts out the tours of the nodes below `node`, and forgets them. Call
+        it before the tree drops the children of `node`.
+        """
+        if node.is_external():
+            return
+        i, j, root = self._span(node)
+        left, rest = _split(root, i + 1)
+        _, right = _split(rest, j - i - 1)
+        _join(left, right)
+        stack = list(node.children)
+        while stack:
+            n = stack.pop()
+            stack.extend(n.children)
+            self.forget(n)
+
+
+class EulerTour(TourOrder):
+    """
+    EulerTour Class
+    Keeps the Euler tour of every node it has seen, and answers subtree
+    queries for them. Node objects still hold their `parent` and `children`
+    so the rest of the code can walk the tree as usual.
+
+    - Init: Writes out the tour of the tree under `root`.
+    - subtree_value(node), subtree_sum(node), subtree_size(node)
+    - position(node): The place of `node` in the tour.
+    - is_ancestor(a, b): Checks if `a` is a proper ancestor of `b`.
+    - put(node, child), flatten(node), swap(a, b), move(node, new_parent)
+    - set_key(node, value): Changes the key of a node.
+    - forget(node): Drops a node removed from the tree.
+    """
+
+    def _new_tokens(self, node):
+        node.backend = self
+        return Token(node, node.key), Token(node)
+
+    def _query(self, node):
+        i, j, root = self._span(node)
+        return _range(root, i, j)
+
+    def subtree_value(self, node):
+        return self._query(node)[0]
+
+    def subtree_sum(self, node):
+        return self._query(node)[1]
+
+    def subtree_size(self, node):
+        return self._query(node)[2]
+
+    def forget(self, node):
+        """
+        Drops the tokens of a node that has left the tree for good.
+        """
+        super().forget(node)
+        node.backend = None
+
+    def put(self, node, child):
+        """
+        Adds `child` (and everything below it) as the last child of `node`.
+        """
+        super().put(node, child)
+        node.link_child(child)
+
+    def flatten(self, node):
+        """
+        Replaces the subtree of `node` by `node` alone, keyed by the sum.
+        The nodes below are forgotten, which takes time in their number, but
+        each node is only forgotten once.
+        """
+        if node.is_external():
+            return
+        opening = self.tokens[node][0]
+        i, j, root = self._span(node)
+        left, rest = _split(root, i)
+        middle, right = _split(rest, j - i + 1)
+        total = middle.total
+
+        # The inner run is cut out, and its nodes forgotten so that the tour
+        # does not keep them alive.
+        head, rest = _split(middle, 1)
+        _, tail = _split(rest, j - i - 1)
+        stack = list(node.children)
+        while stack:
+            n = stack.pop()
+            stack.extend(n.children)
+            self.forget(n)
+
+        node.children = []
+        node.key = total
+        opening.set_key(total)
+        _join(left, head, tail, right)
+
+    def swap(self, subtree_a, subtree_b):
+        """
+        Swaps two subtrees, each becoming the last child of the other's
+        parent.
+        """
+        if subtree_a is subtree_b:
+            return
+        parent_a = subtree_a.parent
+        parent_b = subtree_b.parent
+        if parent_a is None or parent_b is None:
+            return
+        if self.is_ancestor(subtree_a, subtree_b) or \
+                self.is_ancestor(subtree_b, subtree_a):
+            raise ValueError("cannot swap a subtree with its own descendant")
+
+        part_a = self._cut(subtree_a)
+        part_b = self._cut(subtree_b)
+        parent_a.unlink_child(subtree_a)
+        parent_b.unlink_child(subtree_b)
+
+        parent_a.link_child(subtree_b)
+        self._insert(parent_a, part_b)
+        parent_b.link_child(subtree_a)
+        self._insert(parent_b, part_a)
+
+    def set_key(self, node, value):
+        """
+        Changes the key of `node`.
+        """
+        node.key = value
+        self.tokens[node][0].set_key(value)
+
+    def move(self, node, new_parent):
+        """
+        Moves the subtree of `node` to be the last child of `new_parent`.
+        """
+        if node is new_parent or self.is_ancestor(node, new_parent):
+            raise ValueError("cannot move a subtree below itself")
+
+        part = self._cut(node)
+        node.parent.unlink_child(node)
+        new_parent.link_child(node)
+        self._insert(new_parent, part)
+
+
+def _range(t, lo, hi):
+    """
+    Returns (max, sum, opens) over positions `lo`..`hi` of treap `t`.
+    """
+    while t is not None:
+        left_count = t.left.count if t.left is not None else 0
+        if hi < left_count:
+            t = t.left
+        elif lo > left_count:
+            lo -= left_count + 1
+            hi -= left_count + 1
+            t = t.right
+        else:
+            # This token is inside the range, so the rest of the range is a
+            # suffix of the left side and a prefix of the right side.
+            acc = [None, 0, 0]
+            _add_token(acc, t)
+            for part in (_suffix(t.left, lo),
+                         _prefix(t.right, hi - left_count - 1)):
+                _add_values(acc, *part)
+            return tuple(acc)
+    return None, 0, 0
+
+
+def _suffix(t, lo):
+    """
+    Aggregates positions `lo` and after of treap `t`.
+    """
+    acc = [None, 0, 0]
+    while t is not None:
+        left_count = t.left.count if t.left is not None else 0
+        if lo > left_count:
+            lo -= left_count + 1
+            t = t.right
+            continue
+        _add_token(acc, t)
+        _add_treap(acc, t.right)
+        t = t.left
+    return tuple(acc)
+
+
+def _prefix(t, hi):
+    """
+    Aggregates positions up to and including `hi` of treap `t`.
+    """
+    acc = [None, 0, 0]
+    while t is not None:
+        left_count = t.left.count if t.left is not None else 0
+        if hi < left_count:
+            t = t.left
+            continue
+        _add_token(acc, t)
+        _add_treap(acc, t.left)
+        hi -= left_count + 1
+        t = t.right
+    return tuple(acc)
+
+
+def _add_token(acc, t):
+    """
+    Adds a single token to a [max, sum, opens] accumulator.
+    """
+    if t.key is not None:
+        acc[1] += t.key
+        acc[2] += 1
+        if acc[0] is None or t.key > acc[0]:
+            acc[0] = t.key
+
+
+def _add_treap(acc, t):
+    """
+    Adds a whole treap to a [max, sum, opens] accumulator.
+    """
+    if t is not None:
+        _add_values(acc, t.top, t.total, t.opens)
+
+
+def _add_values(acc, top, total, opens):
+    """
+    Adds a (max, sum, opens) triple to a [max, sum, opens] accumulator.
+    """
+    acc[1] += total
+    acc[2] += opens
+    if top is not None and (acc[0] is None or top > acc[0]):
+        acc[0] = top
@@ -0,0 +1,129 @@
+"""
+Frozen Tree
+-----------
+
+A read-only copy of a tree for phases that only query it. The nodes are laid
+out in preorder, so the subtree of the node at offset `i` is the run of
+offsets `i` to `ends[i]` (exclusive). On top of that layout:
+
+    - prefix sums of the keys give the sum of any run,
+    - a sparse table (the max of every run of length 2^j) gives the max of
+      any run from two overlapping lookups,
+
+so subtree size, sum and max, and the max over any preorder range, are all
+O(1). Building takes O(n log n) time and memory.
+
+The frozen tree is a snapshot: changing the original tree afterwards does
+not change it. `thaw()` builds a new mutable `tree.Tree` from it.
+
+Usage:
+    frozen = tree.freeze()
+    frozen.subtree_sum(node)
+    tree = frozen.thaw()
+"""
+
+
+class FrozenTree:
+    """
+    FrozenTree Class
+    Answers subtree queries on a fixed tree from preorder arrays. Nodes are
+    passed in as the `node.Node` objects of the tree it was frozen from.
+
+    - Init: Lays out the tree under `root`.
+    - index(node): The preorder offset of a node.
+    - subtree_value(node), subtree_sum(node), subtree_size(node)
+    - range_max(lo, hi): The largest key at preorder offsets lo..hi-1.
+    - thaw(): Builds a mutable `tree.Tree` with the same shape and keys.
+    """
+
+    def __init__(self, root):
+        """
+        :param root: The root node of the tree to freeze.
+        """
+        self.nodes = []
+        self.keys = []
+        self.parents = []
+        self.offsets = {}
+
+        stack = [(root, -1)]
+        while stack:
+            n, p = stack.pop()
+            self.offsets[n] = len(self.nodes)
+            self.nodes.append(n)
+            self.keys.append(n.key)
+            self.parents.append(p)
+            i = len(self.nodes) - 1
+            for c in reversed(n.children):
+                stack.append((c, i))
+
+        count = len(self.keys)
+
+        # A subtree ends where the next node outside it starts. Going
+        # backwards, every node is finished before its parent is reached.
+        self.ends = list(range(1, count + 1))
+        ends = self.ends
+        parents = self.parents
+        for i in range(count - 1, 0, -1):
+            p = parents[i]
+            if ends[i] > ends[p]:
+                ends[p] = ends[i]
+
+        self.prefix = [0] * (count + 1)
+        total = 0
+        for i, k in enumerate(self.keys):
+            total += k
+            self.prefix[i + 1] = total
+
+        # table[j][i] is the max of keys[i:i + 2^j].
+        self.table = [self.keys]
+        width = 1
+        while 2 * width <= count:
+            row = self.table[-1]
+            self.table.append(list(map(max, row, row[width:])))
+            width *= 2
+
+    def __len__(self):
+        return len(self.keys)
+
+    def index(self, node):
+        """
+        Returns the preorder offset of `node`.
+        """
+        return self.offsets[node]
+
+    def subtree_size(self, node):
+        i = self.offsets[node]
+        return self.ends[i] - i
+
+    def subtree_sum(self, node):
+        i = self.offsets[node]
+        return self.prefix[self.ends[i]] - self.prefix[i]
+
+    def subtree_value(self, node):
+        i = self.offsets[node]
+        return self.range_max(i, self.ends[i])
+
+    def range_max(self, lo, hi):
+        """
+        Returns the largest key at preorder offsets `lo` to `hi - 1`.
+        :param lo: First offset.
+        :param hi: One past the last offset; must be more than `lo`.
+        """
+        if not 0 <= lo < hi <= len(self.keys):
+            raise ValueError("bad range {}..{}".format(lo, hi))
+        j = (hi - lo).bit_length() - 1
+        row = self.table[j]
+        a = row[lo]
+        b = row[hi - (1 << j)]
+        return a if a > b else b
+
+    def thaw(self, **options):
+        """
+        Builds a mutable tree with the same shape and keys, made of new
+        `node.Node` objects.
+        :param options: Passed on to `tree.Tree`, e.g. `backend` or `lazy`.
+        :return: A `tree.Tree`.
+        """
+        import tree
+        return tree.Tree.from_parent_array(self.keys, self.parents,
+                                           **options)
@@ -0,0 +1,211 @@
+"""
+Locked Tree
+-----------
+
+A wrapper that makes a `tree.Tree` safe to share between threads: any
+number of threads may read at the same time, and a writer waits for them
+and has the tree to itself while it changes it, so readers never see an
+ancestor chain that is only half updated.
+
+A finer scheme, with one lock per root path, does not buy anything here:
+every put, flatten and swap changes the sum and size of the root, so no
+two changes ever have disjoint root paths. One readers-writer lock is used
+instead. Waiting writers go first, so a steady stream of readers cannot
+starve them.
+
+Usage:
+    shared = LockedTree(tree)
+    shared.put(parent, child)          # from the writer thread
+    shared.subtree_value(node)         # from any thread
+    with shared.read() as t:           # several reads that must agree
+        ...
+"""
+from contextlib import contextmanager
+import threading
+
+
+class RWLock:
+    """
+    RWLock Class
+    A readers-writer lock that prefers writers.
+
+    - acquire_read() / release_read()
+    - acquire_write() / release_write()
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writing or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writing or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+
+    def release_write(self):
+        with self._cond:
+            self._writing = False
+            self._cond.notify_all()
+
+
+class LockedTree:
+    """
+    LockedTree Class
+    Guards a `tree.Tree` with an `RWLock`. The locks are not reentrant: do
+    not call the wrapper from inside `read()`, `write()` or `batch()`, use
+    the tree they hand out instead.
+
+    - put(node, child), flatten(node), flatten_many(nodes), swap(a, b),
+      move(subtree, new_parent), set_key(node, value), new_node(key):
+      Change the tree under the write lock.
+    - subtree_value(node), subtree_sum(node), subtree_size(node),
+      aggregate(node, name), freeze(): Read under the read lock.
+    - is_ancestor(a, b), depth(node), kth_ancestor(node, k),
+      path_max(node, ancestor): Read under the read lock, once the tables
+      they use are built.
+    - read() / write(): Hold a lock for a block of code.
+    - batch(): `Tree.batch` under the write lock.
+    """
+
+    def __init__(self, tree):
+        """
+        :param tree: The `tree.Tree` to guard. It must not be used directly
+            while it is shared.
+        """
+        self.tree = tree
+        self.lock = RWLock()
+
+    @contextmanager
+    def read(self):
+        """
+        Holds the read lock for the block, and hands out the tree.
+        """
+        if self.tree._lazy is not None:
+            # A lazy tree updates itself when it is read.
+            with self.write() as t:
+                yield t
+            return
+
+        self.lock.acquire_read()
+        try:
+            yield self.tree
+        finally:
+            self.lock.release_read()
+
+    @contextmanager
+    def write(self):
+        """
+        Holds the write lock for the block, and hands out the tree.
+        """
+        self.lock.acquire_write()
+        try:
+            yield self.tree
+        finally:
+            self.lock.release_write()
+
+    @contextmanager
+    def batch(self):
+        """
+        Runs `Tree.batch` under the write lock, so readers only ever see the
+        tree before or after the whole batch.
+        """
+        with self.write() as t:
+            with t.batch():
+                yield t
+
+    def _read_cached(self, built, method, *args):
+        """
+        Calls a query that builds its tables on first use. Building them
+        changes the tree, so that first call takes the write lock.
+        :param built: Function of the tree, True once the tables are there.
+        """
+        with self.read() as t:
+            if built(t):
+                return method(t, *args)
+        with self.write() as t:
+            return method(t, *args)
+
+    def put(self, node, child):
+        with self.write() as t:
+            t.put(node, child)
+
+    def flatten(self, node):
+        with self.write() as t:
+            t.flatten(node)
+
+    def flatten_many(self, nodes):
+        with self.write() as t:
+            return t.flatten_many(nodes)
+
+    def swap(self, subtree_a, subtree_b):
+        with self.write() as t:
+            t.swap(subtree_a, subtree_b)
+
+    def move(self, subtree, new_parent):
+        with self.write() as t:
+            t.move(subtree, new_parent)
+
+    def set_key(self, node, value):
+        with self.write() as t:
+            t.set_key(node, value)
+
+    def new_node(self, key):
+        # Taking a node from the pool changes the pool.
+        with self.write() as t:
+            return t.new_node(key)
+
+    def subtree_value(self, node):
+        with self.read():
+            return node.subtree_value
+
+    def subtree_sum(self, node):
+        with self.read():
+            return node.subtree_sum
+
+    def subtree_size(self, node):
+        with self.read():
+            return node.subtree_size
+
+    def aggregate(self, node, name):
+        with self.read() as t:
+            return t.aggregate(node, name)
+
+    def freeze(self):
+        with self.read() as t:
+            return t.freeze()
+
+    def is_ancestor(self, a, b):
+        return self._read_cached(
+            lambda t: t.backend is not None or t._order is not None,
+            type(self.tree).is_ancestor, a, b)
+
+    def depth(self, node):
+        return self._read_cached(lambda t: t._jumps is not None,
+                                 type(self.tree).depth, node)
+
+    def kth_ancestor(self, node, k):
+        return self._read_cached(lambda t: t._jumps is not None,
+                                 type(self.tree).kth_ancestor, node, k)
+
+    def path_max(self, node, ancestor):
+        return self._read_cached(lambda t: t._jumps is not None,
+                                 type(self.tree).path_max, node, ancestor)
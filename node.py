@@ -6,6 +6,85 @@ This node represents an item in the tree. Each node contains its key as well as
 the value of the subtree rooted at this node. It supports operations to add
 children, as well as check if this is a leaf or not.
 """
+import heapq
+
+
+class ChildValues:
+    """
+    ChildValues Class
+    A counted multiset of the subtree values of a node's children, kept as a
+    max-heap with lazy deletion. Removed values are only counted, and are
+    popped once they reach the top of the heap.
+
+    - add(value): Adds a value.
+    - remove(value): Removes one copy of a value.
+    - replace(old, new): Removes `old` and adds `new`.
+    - max(): Returns the largest value, or None if empty.
+    """
+
+    __slots__ = ("_heap", "_removed", "_stale")
+
+    def __init__(self, values=()):
+        """
+        Builds the heap from the given values.
+        :param values: Iterable of starting values.
+        """
+        self._heap = [-v for v in values]
+        heapq.heapify(self._heap)
+        self._removed = {}
+        self._stale = 0
+
+    def __len__(self):
+        return len(self._heap) - self._stale
+
+    def add(self, value):
+        heapq.heappush(self._heap, -value)
+
+    def remove(self, value):
+        self._removed[value] = self._removed.get(value, 0) + 1
+        self._stale += 1
+        self._prune()
+
+        # Rebuild when the heap is mostly dead entries, so a node whose
+        # children keep changing does not grow without bound.
+        if self._stale > 16 and self._stale * 2 > len(self._heap):
+            self._compact()
+
+    def replace(self, old, new):
+        if old == new:
+            return
+        self.add(new)
+        self.remove(old)
+
+    def max(self):
+        self._prune()
+        if not self._heap:
+            return None
+        return -self._heap[0]
+
+    def _prune(self):
+        heap = self._heap
+        removed = self._removed
+        while heap and -heap[0] in removed:
+            value = -heapq.heappop(heap)
+            removed[value] -= 1
+            if removed[value] == 0:
+                del removed[value]
+            self._stale -= 1
+
+    def _compact(self):
+        live = []
+        removed = self._removed
+        for v in self._heap:
+            if removed.get(-v):
+                removed[-v] -= 1
+            else:
+                live.append(v)
+        heapq.heapify(live)
+        self._heap = live
+        self._removed = {}
+        self._stale = 0
+
 
 class Node:
     """
@@ -13,8 +92,17 @@ class Node:
     - Init: Sets the basic information such as the key, children, and value of
     subtree.
     - add_child(child_node): Adds the child node to the list of children.
+    - remove_child(child_node): Removes the child node from the list of
+      children.
+    - link_child(child_node) / unlink_child(child_node): Only change the
+      list of children and the parent pointer, without any calculations.
     - is_external(): Checks if the node is a leaf.
     - children(): returns the list of children.
+    - add_to_path(d_sum, d_size): Adjusts the subtree sum and size of this
+      node and all of its ancestors.
+    - refresh_value(): Recomputes the subtree value of this node and its
+      ancestors.
+    - set_key(value): Changes the key and updates the ancestors.
     """
 
     def __init__(self, key, parent=None):
@@ -26,9 +114,67 @@ class Node:
         """
         self.key = key
         self.parent = parent
-        self.subtree_value = key
+        self._subtree_value = key
+        self._subtree_sum = key
+        self._subtree_size = 1
         self.children = []
 
+        # Where this node sits in its parent's list of children, so it can
+        # be unlinked without searching the list.
+        self.index_in_parent = None
+
+        # Built the first time it is needed, see `child_max`.
+        self.child_values = None
+
+        # Values of any extra aggregates registered on the tree, by name.
+        self.aggregates = None
+
+        # When set, subtree queries are answered by this object (see
+        # `eulertour.py`) instead of the fields stored on the node.
+        self.backend = None
+
+        # States saved for older versions of the tree, see `versions.py`.
+        self.history = None
+
+    @property
+    def subtree_value(self):
+        """
+        The maximum key in the subtree rooted at this node.
+        """
+        if self.backend is not None:
+            return self.backend.subtree_value(self)
+        return self._subtree_value
+
+    @subtree_value.setter
+    def subtree_value(self, value):
+        self._subtree_value = value
+
+    @property
+    def subtree_sum(self):
+        """
+        The sum of the keys in the subtree rooted at this node.
+        """
+        if self.backend is not None:
+            return self.backend.subtree_sum(self)
+        return self._subtree_sum
+
+    @subtree_sum.setter
+    def subtree_sum(self, value):
+        self._subtree_sum = value
+
+    @property
+    def subtree_size(self):
+        """
+        The number of nodes in the subtree rooted at this node.
+        """
+        if self.backend is not None:
+            return self.backend.subtree_size(self)
+        return self._subtree_size
+
+    @subtree_size.setter
+    def subtree_size(self, value):
+        self._subtree_size = value
+
     def add_child(self, child_node):
         """
         Adds `child_node` as a child of this node. Adds to the list of children
@@ -36,41 +182,134 @@ class Node:
         :param child_node: The child node to add (class Node)
         """
 
+        self.link_child(child_node)
+
+        if self.child_values is not None:
+            self.child_values.add(child_node._subtree_value)
+
+        self.add_to_path(child_node._subtree_sum, child_node._subtree_size)
+        self.refresh_value()
+
+    def remove_child(self, child_node):
+        """
+        Removes `child_node` from the children of this node, and updates the
+        values of this node and its ancestors.
+        :param child_node: The child node to remove (class Node)
+        """
+
+        self.unlink_child(child_node)
+
+        if self.child_values is not None:
+            self.child_values.remove(child_node._subtree_value)
+
+        self.add_to_path(-child_node._subtree_sum, -child_node._subtree_size)
+        self.refresh_value()
+
+    def link_child(self, child_node):
+        """
+        Appends `child_node` to the children and points it at this node.
+        Subtree values are not touched.
+        :param child_node: The child node to link (class Node)
+        """
+
+        child_node.index_in_parent = len(self.children)
         self.children.append(child_node)
+        child_node.parent = self
 
-        i = 0
-        while i < len(self.children):
+    def unlink_child(self, child_node):
+        """
+        Removes `child_node` from the children and clears its parent, in
+        O(1): the last child is moved into the gap, so the order of the
+        remaining children changes, but always in the same way.
+        Subtree values are not touched.
+        :param child_node: The child node to unlink (class Node)
+        """
 
-            if self.subtree_value < self.children[i].subtree_value:
-                self.subtree_value = self.children[i].subtree_value
-            i += 1
+        children = self.children
+        i = child_node.index_in_parent
+        if i is None or i >= len(children) or children[i] is not child_node:
+            # The list was changed by hand, fall back to searching it.
+            i = children.index(child_node)
 
-        n = child_node
+        last = children.pop()
+        if last is not child_node:
+            children[i] = last
+            last.index_in_parent = i
+        child_node.parent = None
+        child_node.index_in_parent = None
 
-        while n.parent != None:
-            if n.parent.subtree_value <= n.subtree_value:
-                n.parent.subtree_value = n.subtree_value
-            else:
-                if n.parent.parent == None:
-                    break
-                else:
-                    if n.parent.subtree_value != n.parent.key:
-                        if n.parent.key < n.subtree_value:
-                            n.parent.subtree_value = n.subtree_value
-                        else:
-                            n.parent.subtree_value = n.parent.key
+    def child_max(self):
+        """
+        Returns the largest subtree value among the children of this node, or
+        None for a leaf.
+        """
+
+        if not self.children:
+            return None
+        if self.child_values is None:
+            self.child_values = ChildValues(
+                c._subtree_value for c in self.children)
+        return self.child_values.max()
+
+    def add_to_path(self, d_sum, d_size):
+        """
+        Adds `d_sum` to the subtree sum and `d_size` to the subtree size of
+        this node and every ancestor up to the root.
+        :param d_sum: Change in the sum of keys below this node.
+        :param d_size: Change in the number of nodes below this node.
+        """
 
+        n = self
+        while n is not None:
+            n._subtree_sum += d_sum
+            n._subtree_size += d_size
             n = n.parent
 
-        # while n.parent != None:
-        #     if n.parent.subtree_value <= nval:
-        #         n.parent.subtree_value = nval
-        #     else:
-        #         if n.key == nval:
-        #             n.parent.subtree_value = n.key
-        #         nval = n.parent.subtree_value
+    def refresh_value(self):
+        """
+        Recomputes the subtree value of this node from its key and children.
+        If it changed, the entry in the parent is replaced and the parent is
+        recomputed too, stopping at the first node whose value stays the same.
+        """
+
+        n = self
+        while n is not None:
+            old = n._subtree_value
+            new = n.key
+            m = n.child_max()
+            if m is not None and m > new:
+                new = m
+            if new == old:
+                return
+
+            n._subtree_value = new
+            p = n.parent
+            if p is not None and p.child_values is not None:
+                p.child_values.replace(old, new)
+            n = p
+
+    def set_key(self, value):
+        """
+        Changes the key of this node. The sums of the ancestors change by
+        the difference, and the subtree values are recomputed only until one
+        stays the same. Nodes of a tree with a backend leave it to the
+        backend.
+
+        This only updates the node and its ancestors, for nodes that are not
+        managed by a `tree.Tree`. A tree also keeps jump tables, versions,
+        aggregates and an operation log that this does not see, so use
+        `Tree.set_key` on nodes in a tree.
+        :param value: The new key.
+        """
+
+        if self.backend is not None:
+            self.backend.set_key(self, value)
+            return
 
-        #     n = n.parent
+        delta = value - self.key
+        self.key = value
+        self.add_to_path(delta, 0)
+        self.refresh_value()
 
     def is_external(self):
         """
@@ -90,14 +329,3 @@ class Node:
         # this here for ease of use and standard usage things in
         # other languages people might be used to.
         return self.children
-
-    def countKey(self, node):
-        if node != None:
-            res = []
-            if node:
-                res.append(node.key)
-                i = 0
-                while i < len(node.children):
-                    res = res + node.countKey(node.children[i])
-                    i+=1
-        return res
@@ -0,0 +1,245 @@
+"""
+Operation Log
+-------------
+
+An append-only log of the changes made to a tree since its last checkpoint,
+so the tree can be rebuilt after a crash from the checkpoint and the tail
+of the log, instead of from scratch.
+
+A checkpoint is a binary snapshot (see `snapshot.py`). Nodes are named by
+ids: at a checkpoint every node gets its offset in preorder, which is also
+its offset in the snapshot, and every node put after that gets the next
+free id, in the order they are put.
+
+File layout (all little-endian):
+
+    header   magic b"TREELOG\\0", version (u32), CRC-32 of the checkpoint
+             (u32), number of nodes in the checkpoint (u64)
+    records  one per change: op (u8) and three signed 64-bit fields
+
+        PUT       parent id, child id, child key   (one per node put)
+        FLATTEN   node id
+        SWAP      subtree a id, subtree b id
+        MOVE      subtree id, new parent id
+        SET_KEY   node id, key
+
+The CRC ties the log to its checkpoint. A new checkpoint is written before
+its empty log, so if the process dies in between, the old log (whose
+changes are all in the new checkpoint) is recognised and skipped. A record
+cut short by a crash is dropped.
+
+Records are buffered; `sync()` forces them to disk.
+
+Usage:
+    tree.checkpoint("tree.snap", "tree.log")
+    tree.put(node, child)              # logged
+    tree.log.sync()
+    ...
+    tree = Tree.recover("tree.snap", "tree.log")
+"""
+import os
+import struct
+import zlib
+
+import snapshot
+
+MAGIC = b"TREELOG\0"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+RECORD = struct.Struct("<Bqqq")
+
+PUT, FLATTEN, SWAP, MOVE, SET_KEY = range(1, 6)
+
+
+def checksum(path):
+    """
+    Returns the CRC-32 of the file at `path`.
+    """
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _write_synced(path, write):
+    """
+    Writes a file through a temporary one, so `path` is either the old file
+    or the whole new one, and makes sure it reached the disk.
+    :param write: Function that writes the file, given a path.
+    """
+    tmp = path + ".tmp"
+    write(tmp)
+    with open(tmp, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class OpLog:
+    """
+    OpLog Class
+    Appends the changes of one tree to a log file.
+
+    - put(node, child), flatten(node), swap(a, b), move(subtree, parent),
+      set_key(node, value): Record a change already made to the tree.
+    - sync(): Flush the records to disk.
+    - close(): Sync and close the file.
+    """
+
+    def __init__(self, path, ids, next_id):
+        """
+        Opens an existing log to append to it. Use `create` for a new one.
+        :param path: The log file.
+        :param ids: dict of node to id, for every node in the tree.
+        :param next_id: The id the next node put will get.
+        """
+        self.path = path
+        self.ids = ids
+        self.next_id = next_id
+        self.file = open(path, "ab")
+
+    @classmethod
+    def create(cls, path, nodes, crc):
+        """
+        Starts an empty log after a checkpoint.
+        :param path: The log file, replaced if it exists.
+        :param nodes: The nodes of the tree in preorder.
+        :param crc: The CRC-32 of the checkpoint file.
+        """
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, crc, len(nodes)))
+
+        _write_synced(path, write)
+        return cls(path, {n: i for i, n in enumerate(nodes)}, len(nodes))
+
+    def _record(self, op, a=0, b=0, c=0):
+        self.file.write(RECORD.pack(op, a, b, c))
+
+    def put(self, node, child):
+        ids = self.ids
+        stack = [child]
+        while stack:
+            n = stack.pop()
+            ids[n] = self.next_id
+            self.next_id += 1
+            self._record(PUT, ids[n.parent], ids[n], n.key)
+            stack.extend(reversed(n.children))
+
+    def flatten(self, node):
+        self._record(FLATTEN, self.ids[node])
+
+    def swap(self, subtree_a, subtree_b):
+        self._record(SWAP, self.ids[subtree_a], self.ids[subtree_b])
+
+    def move(self, subtree, new_parent):
+        self._record(MOVE, self.ids[subtree], self.ids[new_parent])
+
+    def set_key(self, node, value):
+        self._record(SET_KEY, self.ids[node], value)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+
+def read(path):
+    """
+    Reads a log, ignoring a record cut short at the end.
+    :param path: The log file.
+    :return: (crc, count, records, size): the checkpoint CRC, the number of
+        nodes in the checkpoint, the records as tuples, and the size of the
+        file up to the last whole record.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError("{} is not a tree log".format(path))
+    magic, version, crc, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("{} is not a tree log".format(path))
+    if version != VERSION:
+        raise ValueError("unsupported log version {}".format(version))
+
+    whole = (len(data) - HEADER.size) // RECORD.size
+    size = HEADER.size + whole * RECORD.size
+    records = list(RECORD.iter_unpack(data[HEADER.size:size]))
+    return crc, count, records, size
+
+
+def replay(tree, nodes, records):
+    """
+    Applies logged changes to a tree, in one batch.
+    :param tree: The `tree.Tree` the log was written for.
+    :param nodes: The nodes of the tree by id; nodes put are appended.
+    :param records: Records from `read`.
+    """
+    with tree.batch():
+        for op, a, b, c in records:
+            if op == PUT:
+                if b != len(nodes):
+                    raise ValueError("log puts node {}, expected {}".format(
+                        b, len(nodes)))
+                child = tree.new_node(c)
+                nodes.append(child)
+                tree.put(nodes[a], child)
+            elif op == FLATTEN:
+                tree.flatten(nodes[a])
+            elif op == SWAP:
+                tree.swap(nodes[a], nodes[b])
+            elif op == MOVE:
+                tree.move(nodes[a], nodes[b])
+            elif op == SET_KEY:
+                tree.set_key(nodes[a], b)
+            else:
+                raise ValueError("unknown log record {}".format(op))
+
+
+def checkpoint(tree, path, log_path):
+    """
+    Writes `tree` to a snapshot at `path` and starts an empty log for it at
+    `log_path`, which is attached to the tree.
+    """
+    if tree.log is not None:
+        tree.log.close()
+        tree.log = None
+    _write_synced(path, lambda tmp: snapshot.save(tree, tmp))
+    tree.log = OpLog.create(log_path, list(tree.iter_preorder()),
+                            checksum(path))
+
+
+def recover(path, log_path, **options):
+    """
+    Rebuilds a tree from the checkpoint at `path` and the changes logged in
+    `log_path` since, and keeps logging to `log_path`.
+    :param options: Passed on to `tree.Tree`, e.g. `backend` or `lazy`.
+    :return: The `tree.Tree`.
+    """
+    t = snapshot.load(path, mmap=False).to_tree(**options)
+    nodes = list(t.iter_preorder())
+    crc = checksum(path)
+
+    if not os.path.exists(log_path):
+        t.log = OpLog.create(log_path, nodes, crc)
+        return t
+
+    log_crc, count, records, size = read(log_path)
+    if log_crc != crc:
+        # The log is from before this checkpoint, which already holds its
+        # changes.
+        t.log = OpLog.create(log_path, nodes, crc)
+        return t
+    if count != len(nodes):
+        raise ValueError("log expects {} nodes, checkpoint has {}".format(
+            count, len(nodes)))
+
+    replay(t, nodes, records)
+    with open(log_path, "rb+") as f:
+        f.truncate(size)
+    t.log = OpLog(log_path, {n: i for i, n in enumerate(nodes)}, len(nodes))
+    return t
@@ -0,0 +1,181 @@
+"""
+Parallel Recompute
+------------------
+
+Recomputes the subtree values of a whole tree on several processes. This
+pays off for forests: many large trees hung under one (often synthetic)
+root.
+
+The tree is laid out in preorder in one block of shared memory, so the
+subtree of each child of the root is a contiguous run of offsets. The runs
+are grouped into chunks of about the same number of nodes, every chunk is
+worked out by a process of a `ProcessPoolExecutor` straight in the shared
+block, and the results of the root's children are then combined at the
+root.
+
+Keys, sums and sizes are stored as signed 64-bit integers, so keys must be
+integers and sums must fit in 64 bits.
+
+Usage:
+    tree.recompute_all(workers=8)
+    Tree.from_parent_array(keys, parents, workers=8)
+"""
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+
+COLUMNS = ("parents", "keys", "values", "sums", "sizes")
+
+# Aim for a few chunks per worker, so one large tree in the forest does not
+# leave the other workers idle at the end.
+CHUNKS_PER_WORKER = 4
+
+
+def export(root):
+    """
+    Lays out the tree under `root` in preorder.
+    :param root: The root node.
+    :return: (nodes, parents, keys, starts), where `parents` and `keys` are
+        arrays of offsets and keys, and `starts` holds the offset of every
+        child of the root, in order.
+    """
+    nodes = []
+    parents = array("q")
+    keys = array("q")
+    starts = []
+
+    stack = [(root, -1)]
+    while stack:
+        n, p = stack.pop()
+        i = len(nodes)
+        if p == 0:
+            starts.append(i)
+        nodes.append(n)
+        parents.append(p)
+        keys.append(n.key)
+        for c in reversed(n.children):
+            stack.append((c, i))
+
+    return nodes, parents, keys, starts
+
+
+def chunks(starts, count, parts):
+    """
+    Groups the runs of the root's children into at most `parts` contiguous
+    ranges of roughly equal size.
+    :param starts: Offset of each child of the root, in order.
+    :param count: Number of nodes in the tree.
+    :param parts: Number of ranges wanted.
+    :return: List of (lo, hi) offset ranges.
+    """
+    if not starts:
+        return []
+    target = max(1, (count - 1) // parts)
+    ranges = []
+    lo = starts[0]
+    for start in starts[1:]:
+        if start - lo >= target:
+            ranges.append((lo, start))
+            lo = start
+    ranges.append((lo, count))
+    return ranges
+
+
+def _recompute_range(name, count, lo, hi):
+    """
+    Works out the subtree values of offsets `lo`..`hi` (exclusive) of the
+    shared block `name`. Runs in a worker process.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        view = memoryview(block.buf).cast("q")
+        columns = {c: view[i * count:(i + 1) * count]
+                   for i, c in enumerate(COLUMNS)}
+
+        # Plain lists are much faster to work on than the shared views.
+        parents = columns["parents"][lo:hi].tolist()
+        values = columns["keys"][lo:hi].tolist()
+        sums = list(values)
+        sizes = [1] * (hi - lo)
+
+        # Parents come before their children, so going backwards every
+        # node is finished before it is added to its parent.
+        for i in range(hi - lo - 1, -1, -1):
+            p = parents[i] - lo
+            if p < 0:
+                continue
+            if values[i] > values[p]:
+                values[p] = values[i]
+            sums[p] += sums[i]
+            sizes[p] += sizes[i]
+
+        columns["values"][lo:hi] = array("q", values)
+        columns["sums"][lo:hi] = array("q", sums)
+        columns["sizes"][lo:hi] = array("q", sizes)
+        del columns
+        view.release()
+    finally:
+        block.close()
+
+
+def recompute(tree, workers=None):
+    """
+    Recomputes the subtree value, sum and size of every node of `tree`.
+    :param tree: A `tree.Tree`.
+    :param workers: Number of processes, by default one per CPU. With 1 the
+        work is done in this process.
+    :return: The number of nodes in the tree.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    root = tree.root
+    nodes, parents, keys, starts = export(root)
+    count = len(nodes)
+    ranges = chunks(starts, count, workers * CHUNKS_PER_WORKER)
+
+    block = shared_memory.SharedMemory(create=True,
+                                       size=8 * len(COLUMNS) * count)
+    try:
+        view = memoryview(block.buf).cast("q")
+        view[0:count] = parents
+        view[count:2 * count] = keys
+
+        if workers == 1 or len(ranges) < 2:
+            for lo, hi in ranges:
+                _recompute_range(block.name, count, lo, hi)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                jobs = [pool.submit(_recompute_range, block.name, count,
+                                    lo, hi)
+                        for lo, hi in ranges]
+                for job in jobs:
+                    job.result()
+
+        values = view[2 * count:3 * count].tolist()
+        sums = view[3 * count:4 * count].tolist()
+        sizes = view[4 * count:5 * count].tolist()
+        view.release()
+    finally:
+        block.close()
+        block.unlink()
+
+    # The root was left to this process: combine its children.
+    values[0] = root.key
+    sums[0] = root.key
+    sizes[0] = 1
+    for i in starts:
+        if values[i] > values[0]:
+            values[0] = values[i]
+        sums[0] += sums[i]
+        sizes[0] += sizes[i]
+
+    for n, v, s, z in zip(nodes, values, sums, sizes):
+        n._subtree_value = v
+        n._subtree_sum = s
+        n._subtree_size = z
+        n.child_values = None
+    return count
@@ -0,0 +1,74 @@
+"""
+Node Pool
+---------
+
+A free list of `node.Node` objects, for workloads that keep building and
+flattening subtrees.
+
+When a tree with a pool flattens a node, every node that falls out of the
+tree is released: its parent pointer, children and cached values are
+cleared, so the detached nodes no longer form cycles and are freed by
+reference counting instead of waiting for the cyclic garbage collector. Up
+to `limit` of them are kept, and handed out again by `acquire` (or
+`Tree.new_node`) instead of allocating new objects.
+
+For trees that live for the whole run, `Tree.gc_freeze()` moves everything
+allocated so far out of the garbage collector's reach, so later collections
+do not have to walk the tree again.
+
+Usage:
+    t = Tree(root, pool=NodePool())
+    child = t.new_node(5)
+    t.put(root, child)
+"""
+import node
+
+
+class NodePool:
+    """
+    NodePool Class
+    Keeps released nodes for reuse.
+
+    - acquire(key): Returns a fresh node, reusing a released one if any.
+    - release(n): Clears a node that left the tree, and keeps it.
+    """
+
+    def __init__(self, limit=1 << 20):
+        """
+        :param limit: The most released nodes to keep; any more are left
+            to be freed.
+        """
+        self.limit = limit
+        self.free = []
+
+    def __len__(self):
+        return len(self.free)
+
+    def acquire(self, key):
+        """
+        Returns a node with the given key and no parent or children.
+        :param key: The key of the node.
+        """
+        if not self.free:
+            return node.Node(key)
+        n = self.free.pop()
+        n.key = key
+        n._subtree_value = key
+        n._subtree_sum = key
+        n._subtree_size = 1
+        return n
+
+    def release(self, n):
+        """
+        Clears everything `n` points to, and keeps it for reuse if there
+        is room. The caller must make sure nothing uses `n` any more.
+        :param n: A node no longer in any tree.
+        """
+        n.parent = None
+        n.children = []
+        n.index_in_parent = None
+        n.child_values = None
+        n.aggregates = None
+        n.backend = None
+        if len(self.free) < self.limit:
+            self.free.append(n)
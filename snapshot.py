@@ -0,0 +1,132 @@
+"""
+Snapshots
+---------
+
+Saves trees to a compact binary file and loads them back without creating
+a `Node` object per item.
+
+File layout (all little-endian):
+
+    header   magic b"TREESNAP", version (u32), columns (u32), count (u64)
+    columns  `count` signed 64-bit integers each, in this order:
+             parents, keys, subtree_values, first_child, last_child,
+             next_sibling, prev_sibling
+
+Nodes are stored in preorder, so the root is node 0. Parent and child
+columns hold node offsets, with -1 meaning "none". These are exactly the
+arrays of `compact.CompactTree`, which is what `load` returns; with
+`mmap=True` the arrays are views straight onto the (privately mapped) file.
+
+Usage:
+    tree.save("tree.snap")
+    compact_tree = Tree.load("tree.snap")
+"""
+from array import array
+import mmap as _mmap
+import struct
+import sys
+
+import compact
+
+MAGIC = b"TREESNAP"
+VERSION = 2
+HEADER = struct.Struct("<8sIIQ")
+COLUMNS = ("parents", "keys", "subtree_values",
+           "first_child", "last_child", "next_sibling", "prev_sibling")
+
+
+def node_columns(root):
+    """
+    Lays out the tree under `root` (made of `node.Node`) in preorder.
+    :param root: The root node.
+    :return: dict of column name to array.
+    """
+    columns = {name: array("q") for name in COLUMNS}
+    parents = columns["parents"]
+    first_child = columns["first_child"]
+    last_child = columns["last_child"]
+    next_sibling = columns["next_sibling"]
+    prev_sibling = columns["prev_sibling"]
+
+    # Each stack entry is a node and the offset of its parent. Children are
+    # pushed in reverse so they come out in order.
+    stack = [(root, compact.NIL)]
+    while stack:
+        n, p = stack.pop()
+        i = len(parents)
+        parents.append(p)
+        columns["keys"].append(n.key)
+        columns["subtree_values"].append(n.subtree_value)
+        first_child.append(compact.NIL)
+        last_child.append(compact.NIL)
+        next_sibling.append(compact.NIL)
+        prev_sibling.append(compact.NIL)
+
+        if p != compact.NIL:
+            if first_child[p] == compact.NIL:
+                first_child[p] = i
+            else:
+                next_sibling[last_child[p]] = i
+                prev_sibling[i] = last_child[p]
+            last_child[p] = i
+
+        for c in reversed(n.children):
+            stack.append((c, i))
+
+    return columns
+
+
+def save(tree, path):
+    """
+    Writes `tree` to `path`.
+    :param tree: A `tree.Tree` or a `compact.CompactTree`.
+    :param path: The file to write.
+    """
+    if isinstance(tree, compact.CompactTree):
+        columns = tree.preorder_columns()
+    else:
+        columns = node_columns(tree.root)
+
+    count = len(columns["keys"])
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(COLUMNS), count))
+        for name in COLUMNS:
+            column = columns[name]
+            if sys.byteorder != "little":
+                column = array("q", column)
+                column.byteswap()
+            column.tofile(f)
+
+
+def load(path, mmap=True):
+    """
+    Reads a tree written by `save`.
+    :param path: The file to read.
+    :param mmap: If True, map the file into memory (copy on write) instead of
+        reading it, so only the pages that are touched get loaded.
+    :return: A `compact.CompactTree`.
+    """
+    with open(path, "rb") as f:
+        magic, version, ncolumns, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not a tree snapshot".format(path))
+        if version != VERSION or ncolumns != len(COLUMNS):
+            raise ValueError("unsupported snapshot version {}".format(version))
+
+        columns = {}
+        if mmap and sys.byteorder == "little" and count > 0:
+            data = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_COPY)
+            view = memoryview(data)
+            offset = HEADER.size
+            for name in COLUMNS:
+                columns[name] = view[offset:offset + 8 * count].cast("q")
+                offset += 8 * count
+        else:
+            for name in COLUMNS:
+                column = array("q")
+                column.fromfile(f, count)
+                if sys.byteorder != "little":
+                    column.byteswap()
+                columns[name] = column
+
+    return compact.CompactTree.from_columns(columns)
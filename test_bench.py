@@ -0,0 +1,112 @@
+"""
+Benchmark tests
+---------------
+
+Runs the benchmarks on small trees, to check the shapes they generate and
+the results they report.
+
+To run this, in the main directory run:
+
+python -m unittest test_bench.py
+
+"""
+import json
+import random
+import unittest
+
+import bench
+
+
+def depth(parents):
+    depths = [0] * len(parents)
+    for i in range(1, len(parents)):
+        depths[i] = depths[parents[i]] + 1
+    return max(depths)
+
+
+class ShapeTestCase(unittest.TestCase):
+    """
+    The generated shapes are trees of the right size and depth.
+    """
+
+    def test_shapes(self):
+        n = 1001
+        expected = {"chain": n - 1, "star": 1, "kary": 9,
+                    "caterpillar": (n + 1) // 2 - 1}
+        for name, shape in bench.SHAPES.items():
+            parents = shape(n, random.Random(0))
+            assert len(parents) == n, \
+                "expected: {}, got: {}".format(n, len(parents))
+            assert parents[0] == -1, "{}: root has a parent".format(name)
+            assert all(0 <= p < i for i, p in enumerate(parents) if i), \
+                "{}: a parent comes after its child".format(name)
+            if name in expected:
+                assert depth(parents) == expected[name], \
+                    "{}: expected: {}, got: {}".format(
+                        name, expected[name], depth(parents))
+
+
+class BenchTestCase(unittest.TestCase):
+    """
+    Every combination is measured, and the results can be written as JSON.
+    """
+
+    def test_run(self):
+        report = bench.run(sizes=[200, 800], count=20, visit_count=10)
+        results = report["results"]
+        count = 2 * len(bench.SHAPES) * len(bench.OPS) * \
+            len(bench.IMPLEMENTATIONS)
+        assert len(results) == count, \
+            "expected: {}, got: {}".format(count, len(results))
+        json.loads(json.dumps(report))
+
+        for r in results:
+            if r["error"] is None and r["ops"]:
+                assert r["ops_per_sec"] > 0, "no rate for {}".format(r)
+                assert r["visits_per_op"] >= 1, "no visits for {}".format(r)
+                assert r["build_peak_bytes"] > 0, "no memory for {}".format(r)
+
+        # Walking a chain to the root grows with the tree; a star does not.
+        fits = {(f["impl"], f["shape"], f["op"]): f["visits_exponent"]
+                for f in report["summary"]}
+        chain = fits["tree", "chain", "put"]
+        star = fits["tree", "star", "put"]
+        assert chain > 0.8, "expected: {}, got: {}".format("> 0.8", chain)
+        assert star < 0.2, "expected: {}, got: {}".format("< 0.2", star)
+
+    def test_swap_needs_two_leaves(self):
+        r = bench.measure("tree", "chain", 100, "swap", count=5)
+        assert r["ops"] == 0, "expected: {}, got: {}".format(0, r["ops"])
+        assert r["error"] is None, "unexpected error: {}".format(r["error"])
+
+    def test_swap_subtrees_plan(self):
+        n = 1000
+        parents = bench.SHAPES["kary"](n, random.Random(0))
+        sizes = [1] * n
+        for i in range(n - 1, 0, -1):
+            sizes[parents[i]] += sizes[i]
+        pairs = bench.plan("swap_subtrees", parents, 200, random.Random(1))
+        assert len(pairs) == 200, \
+            "expected: {}, got: {}".format(200, len(pairs))
+        for a, b in pairs:
+            assert a != b and parents[a] == parents[b], \
+                "expected siblings, got: {}, {}".format(a, b)
+        # Pairs are drawn from every depth, so both whole branches below the
+        # root and single leaves are swapped.
+        largest = max(sizes[a] for a, _ in pairs)
+        smallest = min(sizes[a] for a, _ in pairs)
+        assert largest > n // 4, \
+            "expected: {}, got: {}".format("> {}".format(n // 4), largest)
+        assert smallest == 1, "expected: {}, got: {}".format(1, smallest)
+
+    def test_swap_subtrees_does_not_walk_subtrees(self):
+        report = bench.run(sizes=[200, 800, 3200], shapes=["kary"],
+                           ops=["swap_subtrees"], impls=["tree"],
+                           count=20, visit_count=20)
+        e = report["summary"][0]["visits_exponent"]
+        assert e < 0.5, "expected: {}, got: {}".format("< 0.5", e)
+
+    def test_fit_exponent(self):
+        e = bench.fit_exponent([10, 100, 1000], [3, 30, 300])
+        assert abs(e - 1) < 1e-9, "expected: {}, got: {}".format(1, e)
+        assert bench.fit_exponent([10], [3]) is None
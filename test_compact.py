@@ -0,0 +1,262 @@
+"""
+Compact tree tests
+------------------
+
+Checks that the struct-of-arrays tree in `compact.py` behaves the same as the
+object-per-node tree for put, flatten and swap.
+
+To run this, in the main directory run:
+
+python -m unittest test_compact.py
+
+"""
+import os
+import random
+import tempfile
+import unittest
+
+import compact
+import tree
+
+
+def check_values(tree):
+    """
+    Recomputes every subtree value of `tree` from scratch, compares them
+    with the maintained ones, and checks that every child list links up
+    both ways.
+    """
+    order = list(tree.preorder())
+    for i in reversed(order):
+        value = tree.keys[i]
+        prev = compact.NIL
+        for c in tree.child_indices(i):
+            assert tree.parents[c] == i, "child {} not under {}".format(c, i)
+            assert tree.prev_sibling[c] == prev, \
+                "expected: {}, got: {}".format(prev, tree.prev_sibling[c])
+            value = max(value, tree.subtree_values[c])
+            prev = c
+        assert tree.last_child[i] == prev, \
+            "expected: {}, got: {}".format(prev, tree.last_child[i])
+        assert tree.subtree_values[i] == value, \
+            "expected: {}, got: {}".format(value, tree.subtree_values[i])
+
+
+class CompactTreeTestCase(unittest.TestCase):
+    """
+    Mirrors the simple tree tests against `CompactTree`.
+    """
+
+    def setUp(self):
+        self.tree = compact.CompactTree(5)
+
+    def test_bubble_up_value(self):
+        """
+        root
+        |  \
+        A  B
+        |
+        C
+        |
+        D
+        """
+        root = self.tree.root
+        node_a = self.tree.new_node(4)
+        node_b = self.tree.new_node(5)
+        node_c = self.tree.new_node(6)
+        node_d = self.tree.new_node(8)
+
+        self.tree.put(root, node_a)
+        self.tree.put(root, node_b)
+        self.tree.put(node_a, node_c)
+        self.tree.put(node_c, node_d)
+
+        assert len(root.children) == 2, \
+            "expected: {}, got: {}".format(2, len(root.children))
+        assert root.subtree_value == 8, \
+            "expected: {}, got: {}".format(8, root.subtree_value)
+        assert node_a.subtree_value == 8, \
+            "expected: {}, got: {}".format(8, node_a.subtree_value)
+        assert node_d.parent == node_c
+
+    def test_flatten_merge(self):
+        """
+          r         r
+        / |    >  /  |
+        A  B     A  B_NEW
+         / |
+        C  D
+        """
+        root = self.tree.root
+        node_a = self.tree.new_node(4)
+        node_b = self.tree.new_node(5)
+        node_c = self.tree.new_node(5)
+        node_d = self.tree.new_node(59)
+
+        self.tree.put(root, node_a)
+        self.tree.put(root, node_b)
+        self.tree.put(node_b, node_c)
+        self.tree.put(node_b, node_d)
+
+        self.tree.flatten(node_b)
+
+        assert node_b.is_external(), "Node should be leaf after flattening."
+        assert node_b.key == 69, "expected: {}, got {}".format(69, node_b.key)
+        assert root.subtree_value == 69, \
+            "expected: {}, got: {}".format(69, root.subtree_value)
+
+    def test_swap_lowers_value(self):
+        """
+Swaps B and D, then swaps them back so C has to drop from 10 to 8.
+
+           A(5)
+           / \
+         C(2) B(10)
+          |
+         D(8)
+        """
+        root = self.tree.root
+        node_c = self.tree.new_node(2)
+        node_b = self.tree.new_node(10)
+        node_d = self.tree.new_node(8)
+
+        self.tree.put(root, node_b)
+        self.tree.put(root, node_c)
+        self.tree.put(node_c, node_d)
+
+        self.tree.swap(node_b, node_d)
+        assert node_c.subtree_value == 10, \
+            "expected: {}, got: {}".format(10, node_c.subtree_value)
+
+        self.tree.swap(node_b, node_d)
+        assert node_c.subtree_value == 8, \
+            "expected: {}, got: {}".format(8, node_c.subtree_value)
+        assert root.subtree_value == 10, \
+            "expected: {}, got: {}".format(10, root.subtree_value)
+
+    def test_swap_with_descendant(self):
+        """
+        Swapping a subtree with one inside it is refused, and swapping one
+        with itself does nothing.
+
+           A(5)
+            |
+           C(2)
+            |
+           D(8)
+        """
+        root = self.tree.root
+        node_c = self.tree.new_node(2)
+        node_d = self.tree.new_node(8)
+        self.tree.put(root, node_c)
+        self.tree.put(node_c, node_d)
+
+        with self.assertRaises(ValueError):
+            self.tree.swap(node_c, node_d)
+        with self.assertRaises(ValueError):
+            self.tree.swap(node_d, node_c)
+        self.tree.swap(node_c, node_c)
+
+        assert root.children == [node_c], \
+            "expected: {}, got: {}".format([node_c], root.children)
+        assert node_c.children == [node_d], \
+            "expected: {}, got: {}".format([node_d], node_c.children)
+        assert root.subtree_value == 8, \
+            "expected: {}, got: {}".format(8, root.subtree_value)
+
+    def test_swap_under_wide_node(self):
+        """
+        Swaps the children of a wide node with leaves elsewhere, so values
+        drop and rise under a node that keeps a heap of child values.
+        """
+        rng = random.Random(3)
+        root = self.tree.root
+        wide = self.tree.new_node(0)
+        other = self.tree.new_node(0)
+        self.tree.put(root, wide)
+        self.tree.put(root, other)
+        for _ in range(200):
+            self.tree.put(wide, self.tree.new_node(rng.randint(0, 1000)))
+            self.tree.put(other, self.tree.new_node(rng.randint(0, 1000)))
+
+        for _ in range(2000):
+            a = rng.choice(wide.children)
+            b = rng.choice(other.children)
+            self.tree.swap(a, b)
+        assert wide.index in self.tree._child_values, "no heap for wide"
+        check_values(self.tree)
+
+        for c in other.children[::2]:
+            self.tree.put(c, self.tree.new_node(rng.randint(0, 2000)))
+            self.tree.flatten(c)
+            self.tree.swap(c, rng.choice(wide.children))
+        check_values(self.tree)
+
+    def test_recompute_all(self):
+        """
+        Recomputes the values of loaded random, wide and deep trees, whose
+        saved values were wiped, both ways. The deep one is left to the
+        plain loop.
+        """
+        rng = random.Random(5)
+        count = 10 ** 5
+        shapes = [
+            [-1] + [rng.randrange(i) for i in range(1, count)],
+            [-1] + [0] * (count - 1),
+            [-1] + [i // 4 for i in range(count - 1)],
+            list(range(-1, count - 1)),
+        ]
+        handle, path = tempfile.mkstemp(suffix=".snap")
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        for parents in shapes:
+            keys = [rng.randint(-10 ** 6, 10 ** 6) for _ in range(count)]
+            tree.Tree.from_parent_array(keys, parents).save(path)
+            for vectorized in (False, True):
+                if vectorized and compact.np is None:
+                    continue
+                loaded = tree.Tree.load(path)
+                expected = list(loaded.subtree_values)
+                for i in range(count):
+                    loaded.subtree_values[i] = 0
+
+                got = loaded.recompute_all(vectorized=vectorized)
+                assert got == count, \
+                    "expected: {}, got: {}".format(count, got)
+                assert list(loaded.subtree_values) == expected, \
+                    "recomputed values differ"
+                del loaded
+
+    def test_recompute_skips_flattened_slots(self):
+        """
+        Slots left behind by flatten are not counted, and do not change
+        the values of the nodes still in the tree.
+        """
+        root = self.tree.root
+        node_a = self.tree.new_node(4)
+        node_b = self.tree.new_node(50)
+        self.tree.put(root, node_a)
+        self.tree.put(node_a, node_b)
+        self.tree.put(node_b, self.tree.new_node(70))
+        self.tree.flatten(node_b)
+        self.tree.keys[node_b.index] = 1
+
+        for vectorized in (False, True):
+            if vectorized and compact.np is None:
+                continue
+            count = self.tree.recompute_all(vectorized=vectorized)
+            assert count == 3, "expected: {}, got: {}".format(3, count)
+            assert root.subtree_value == 5, \
+                "expected: {}, got: {}".format(5, root.subtree_value)
+
+    def test_memory_is_smaller(self):
+        """
+        The arrays should use a fraction of the memory of Node objects.
+        """
+        usage = compact.compare_memory(10000)
+        assert usage["compact"] < usage["node"] / 2, \
+            "expected compact < node / 2, got: {}".format(usage)
+
+
+if __name__ == '__main__':
+    unittest.main()
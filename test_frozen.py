@@ -0,0 +1,102 @@
+"""
+Frozen tree tests
+-----------------
+
+Queries trees frozen with `Tree.freeze` and thaws them again.
+
+To run this, in the main directory run:
+
+python -m unittest test_frozen.py
+
+"""
+import random
+import unittest
+
+import node
+import tree
+from test_large_trees import check_values, make_chain
+
+
+class FrozenTestCase(unittest.TestCase):
+    """
+    Subtree and range queries on frozen trees.
+    """
+
+    def setUp(self):
+        """
+        Builds:
+
+                r(5)
+              /  |   \\
+            A(4) B(9) C(6)
+            |        /  \\
+            D(7)   E(1)  F(2)
+        """
+        root = node.Node(5)
+        self.tree = tree.Tree(root)
+        self.nodes = {"r": root}
+        for name, key, parent in [("A", 4, "r"), ("B", 9, "r"),
+                                  ("C", 6, "r"), ("D", 7, "A"),
+                                  ("E", 1, "C"), ("F", 2, "C")]:
+            self.nodes[name] = node.Node(key)
+            self.tree.put(self.nodes[parent], self.nodes[name])
+
+    def test_subtree_queries(self):
+        frozen = self.tree.freeze()
+        for n in self.nodes.values():
+            got = (frozen.subtree_value(n), frozen.subtree_sum(n),
+                   frozen.subtree_size(n))
+            expected = (n.subtree_value, n.subtree_sum, n.subtree_size)
+            assert got == expected, \
+                "expected: {}, got: {}".format(expected, got)
+
+    def test_range_max(self):
+        frozen = self.tree.freeze()
+        # Preorder: r A D B C E F
+        assert frozen.range_max(1, 3) == 7, \
+            "expected: {}, got: {}".format(7, frozen.range_max(1, 3))
+        assert frozen.range_max(4, 7) == 6, \
+            "expected: {}, got: {}".format(6, frozen.range_max(4, 7))
+        assert frozen.range_max(5, 6) == 1, \
+            "expected: {}, got: {}".format(1, frozen.range_max(5, 6))
+        with self.assertRaises(ValueError):
+            frozen.range_max(3, 3)
+
+    def test_is_a_snapshot(self):
+        frozen = self.tree.freeze()
+        self.tree.flatten(self.nodes["C"])
+        assert frozen.subtree_size(self.nodes["r"]) == 7, \
+            "expected: {}, got: {}".format(
+                7, frozen.subtree_size(self.nodes["r"]))
+
+    def test_thaw(self):
+        thawed = self.tree.freeze().thaw()
+        check_values(thawed.root)
+        keys = [n.key for n in thawed.iter_preorder()]
+        assert keys == [5, 4, 7, 9, 6, 1, 2], \
+            "expected: {}, got: {}".format([5, 4, 7, 9, 6, 1, 2], keys)
+        assert thawed.root is not self.tree.root
+
+    def test_random_tree(self):
+        rng = random.Random(17)
+        count = 10 ** 4
+        parents = [-1] + [rng.randrange(i) for i in range(1, count)]
+        keys = [rng.randint(-1000, 1000) for _ in range(count)]
+        t = tree.Tree.from_parent_array(keys, parents)
+        frozen = t.freeze()
+        for n in t.iter_preorder():
+            got = (frozen.subtree_value(n), frozen.subtree_sum(n),
+                   frozen.subtree_size(n))
+            expected = (n.subtree_value, n.subtree_sum, n.subtree_size)
+            assert got == expected, \
+                "expected: {}, got: {}".format(expected, got)
+
+    def test_deep_chain(self):
+        root, nodes = make_chain(10 ** 5)
+        frozen = tree.Tree(root).freeze()
+        assert frozen.subtree_sum(nodes[1]) == sum(range(1, 10 ** 5)), \
+            "expected: {}, got: {}".format(sum(range(1, 10 ** 5)),
+                                           frozen.subtree_sum(nodes[1]))
+        assert frozen.subtree_value(nodes[500]) == 10 ** 5 - 1, \
+            "expected: {}, got: {}".format(10 ** 5 - 1,
+                                           frozen.subtree_value(nodes[500]))
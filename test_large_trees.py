@@ -0,0 +1,814 @@
+"""
+Large tree tests
+----------------
+
+Checks that tree operations still work on trees that are far deeper or wider
+than the recursion limit.
+
+To run this, in the main directory run:
+
+python -m unittest test_large_trees.py
+
+"""
+import random
+import unittest
+
+import aggregates
+import node
+import tree
+
+SIZE = 10 ** 6
+
+
+def fill_values(nodes):
+    """
+    Fills in the subtree values of nodes that were linked by hand. Every
+    parent must come before its children in `nodes`.
+    :param nodes: The list of nodes.
+    """
+    for n in reversed(nodes):
+        p = n.parent
+        if p is not None:
+            p.subtree_sum += n.subtree_sum
+            p.subtree_size += n.subtree_size
+            if p.subtree_value < n.subtree_value:
+                p.subtree_value = n.subtree_value
+
+
+def make_chain(n):
+    """
+    Links `n` nodes into a chain without going through `put`.
+    :param n: Number of nodes.
+    :return: (root, list of nodes)
+    """
+    nodes = [node.Node(i) for i in range(n)]
+    for i in range(1, n):
+        nodes[i - 1].link_child(nodes[i])
+    fill_values(nodes)
+    return nodes[0], nodes
+
+
+def make_star(n):
+    """
+    Links `n - 1` leaves under a single root without going through `put`.
+    :param n: Number of nodes.
+    :return: (root, list of nodes)
+    """
+    nodes = [node.Node(i) for i in range(n)]
+    for i in range(1, n):
+        nodes[0].link_child(nodes[i])
+    fill_values(nodes)
+    return nodes[0], nodes
+
+
+def check_values(root):
+    """
+    Recomputes every subtree value below `root` from scratch and compares
+    them with the maintained ones.
+    :param root: The root of the tree to check.
+    """
+    order = []
+    stack = [root]
+    while stack:
+        n = stack.pop()
+        order.append(n)
+        stack.extend(n.children)
+
+    expected = {}
+    for n in reversed(order):
+        value, total, size = n.key, n.key, 1
+        for c in n.children:
+            c_value, c_total, c_size = expected[c]
+            value = max(value, c_value)
+            total += c_total
+            size += c_size
+        expected[n] = (value, total, size)
+        got = (n.subtree_value, n.subtree_sum, n.subtree_size)
+        assert got == expected[n], \
+            "expected: {}, got: {}".format(expected[n], got)
+
+
+class LargeTreeTestCase(unittest.TestCase):
+    """
+    Operations on chains and stars of a million nodes.
+    """
+
+    def test_flatten_chain(self):
+        root, nodes = make_chain(SIZE)
+        t = tree.Tree(root)
+
+        t.flatten(root)
+
+        expected = SIZE * (SIZE - 1) // 2
+        assert root.key == expected, \
+            "expected: {}, got: {}".format(expected, root.key)
+        assert root.is_external(), "Node should be leaf after flattening."
+
+    def test_flatten_star(self):
+        root, nodes = make_star(SIZE)
+        t = tree.Tree(root)
+
+        t.flatten(root)
+
+        expected = SIZE * (SIZE - 1) // 2
+        assert root.key == expected, \
+            "expected: {}, got: {}".format(expected, root.key)
+        assert root.is_external(), "Node should be leaf after flattening."
+
+    def test_flatten_middle_of_chain(self):
+        root, nodes = make_chain(SIZE)
+        t = tree.Tree(root)
+        middle = nodes[SIZE // 2]
+
+        t.flatten(middle)
+
+        assert root.subtree_size == SIZE // 2 + 1, \
+            "expected: {}, got: {}".format(SIZE // 2 + 1, root.subtree_size)
+        assert root.subtree_sum == SIZE * (SIZE - 1) // 2, \
+            "expected: {}, got: {}".format(SIZE * (SIZE - 1) // 2,
+                                           root.subtree_sum)
+
+    def test_swap_under_wide_node(self):
+        """
+        Swapping the largest leaf of a 10^5 child star in and out of a
+        deeper spot must lower the root's value again.
+        """
+        root, nodes = make_star(10 ** 5)
+        t = tree.Tree(root)
+        low = node.Node(-1)
+        t.put(nodes[1], low)
+
+        for _ in range(100):
+            t.swap(nodes[-1], low)
+            t.swap(nodes[-1], low)
+
+        assert nodes[1].subtree_value == 1, \
+            "expected: {}, got: {}".format(1, nodes[1].subtree_value)
+
+        t.swap(nodes[-1], low)
+        assert nodes[1].subtree_value == 10 ** 5 - 1, \
+            "expected: {}, got: {}".format(10 ** 5 - 1, nodes[1].subtree_value)
+        assert root.subtree_value == 10 ** 5 - 1, \
+            "expected: {}, got: {}".format(10 ** 5 - 1, root.subtree_value)
+        check_values(root)
+
+    def test_swap_with_descendant(self):
+        """
+        Swapping a node of a 10^5 chain with one below it must be refused
+        without changing the tree.
+        """
+        root, nodes = make_chain(10 ** 5)
+        t = tree.Tree(root)
+        leaf = node.Node(-1)
+        t.put(nodes[10], leaf)
+        other = node.Node(-2)
+        t.put(nodes[30], other)
+
+        for i in range(1000):
+            with self.assertRaises(ValueError):
+                t.swap(nodes[20], nodes[30])
+            t.swap(leaf, other)
+            assert t.is_ancestor(nodes[20], leaf) == (i % 2 == 0), \
+                "wrong ancestor after {} swaps".format(i + 1)
+
+        assert t.is_ancestor(nodes[10], leaf), "leaf left the chain"
+        assert not t.is_ancestor(leaf, nodes[10]), "chain below the leaf"
+        assert root.subtree_size == 10 ** 5 + 2, \
+            "expected: {}, got: {}".format(10 ** 5 + 2, root.subtree_size)
+
+    def test_swap_large_siblings(self):
+        """
+        Swaps the two halves of a 2^18 node binary tree back and forth.
+        Each swap must cost O(log n), not the size of the halves.
+        """
+        n = 2 ** 18 - 1
+        parents = [-1] + [(i - 1) // 2 for i in range(1, n)]
+        t = tree.Tree.from_parent_array(list(range(n)), parents)
+        root = t.root
+        a, b = root.children
+        deep_a = a.children[0].children[1]
+        deep_b = b.children[1]
+
+        for i in range(10 ** 4):
+            t.swap(a, b)
+            with self.assertRaises(ValueError):
+                t.swap(a, deep_a)
+            assert t.is_ancestor(a, deep_a), "a lost its subtree"
+            assert not t.is_ancestor(deep_b, deep_a), "b is above a"
+
+        assert a.parent is root and b.parent is root, "a half moved away"
+        assert root.subtree_size == n, \
+            "expected: {}, got: {}".format(n, root.subtree_size)
+        check_values(root)
+
+    def test_move_large_subtree(self):
+        """
+        Moves a 2^16 node subtree between the halves of a binary tree. The
+        walk to the common ancestor and the ancestor check must not visit
+        the subtree itself.
+        """
+        n = 2 ** 18 - 1
+        parents = [-1] + [(i - 1) // 2 for i in range(1, n)]
+        t = tree.Tree.from_parent_array(list(range(n)), parents)
+        root = t.root
+        a, b = root.children
+        subtree = a.children[0]
+        target = b.children[1].children[0]
+
+        for _ in range(10 ** 3):
+            t.move(subtree, target)
+            t.move(subtree, a)
+            with self.assertRaises(ValueError):
+                t.move(a, subtree.children[0])
+
+        assert subtree.parent is a, "subtree in the wrong place"
+        assert t.is_ancestor(a, subtree), "a is not above the subtree"
+        assert not t.is_ancestor(b, subtree), "b is above the subtree"
+        check_values(root)
+
+    def test_jumps_on_deep_chain(self):
+        """
+        Ancestor and path max queries on a 10^5 chain.
+        """
+        size = 10 ** 5
+        root, nodes = make_chain(size)
+        t = tree.Tree(root)
+        bottom = nodes[-1]
+
+        assert t.depth(bottom) == size - 1, \
+            "expected: {}, got: {}".format(size - 1, t.depth(bottom))
+        assert t.kth_ancestor(bottom, size - 1) is root, "wrong root"
+        assert t.kth_ancestor(bottom, size) is None, "above the root"
+        assert t.path_max(bottom, nodes[10]) == size - 1, \
+            "expected: {}, got: {}".format(size - 1,
+                                           t.path_max(bottom, nodes[10]))
+        assert t.path_max(nodes[1000], root) == 1000, \
+            "expected: {}, got: {}".format(1000, t.path_max(nodes[1000], root))
+        with self.assertRaises(ValueError):
+            t.path_max(nodes[10], bottom)
+
+        leaf = node.Node(-1)
+        t.put(nodes[10], leaf)
+        assert t.depth(leaf) == 11, \
+            "expected: {}, got: {}".format(11, t.depth(leaf))
+
+        t.flatten(nodes[50000])
+        assert t.path_max(leaf, root) == 10, \
+            "expected: {}, got: {}".format(10, t.path_max(leaf, root))
+        assert t.kth_ancestor(nodes[50000], 50000) is root, "wrong root"
+
+    def test_flatten_many_under_wide_node(self):
+        """
+        Flattens 1000 children of a node with 10^5 children, each with a
+        small subtree, plus nodes nested inside them.
+        """
+        root, nodes = make_star(10 ** 5)
+        t = tree.Tree(root)
+        for n in nodes[1:1001]:
+            t.put(n, node.Node(10 ** 6))
+        nested = [n.children[0] for n in nodes[1:1001:2]]
+
+        flattened = t.flatten_many(nodes[1:1001] + nested)
+
+        assert len(flattened) == 1000, \
+            "expected: {}, got: {}".format(1000, len(flattened))
+        assert root.subtree_size == 10 ** 5, \
+            "expected: {}, got: {}".format(10 ** 5, root.subtree_size)
+        assert root.subtree_value == 10 ** 6 + 1000, \
+            "expected: {}, got: {}".format(10 ** 6 + 1000, root.subtree_value)
+        check_values(root)
+
+    def test_top_k_on_deep_chain(self):
+        """
+        With a registered TopK the top keys of a 10^5 chain are read at
+        the root, and kept up to date by put and flatten.
+        """
+        root, nodes = make_chain(10 ** 5)
+        t = tree.Tree(root)
+        t.register_aggregate(aggregates.TopK(10))
+
+        t.put(nodes[-1], node.Node(10 ** 6))
+        t.flatten(nodes[-3])
+        got = t.top_k(root, 4)
+        expected = [10 ** 6 + 3 * 10 ** 5 - 6, 10 ** 5 - 4, 10 ** 5 - 5,
+                    10 ** 5 - 6]
+        assert got == expected, \
+            "expected: {}, got: {}".format(expected, got)
+
+    def test_top_k_under_wide_node(self):
+        """
+        Without the aggregate, the top keys below the root of a 10^5 child
+        star are found by pushing only as many children as are missing.
+        """
+        root, nodes = make_star(10 ** 5)
+        t = tree.Tree(root)
+        t.put(nodes[5], node.Node(10 ** 6))
+        t.put(nodes[6], node.Node(10 ** 5 - 2))
+
+        got = t.top_k(root, 4)
+        expected = [10 ** 6, 10 ** 5 - 1, 10 ** 5 - 2, 10 ** 5 - 2]
+        assert got == expected, \
+            "expected: {}, got: {}".format(expected, got)
+
+    def test_move_near_bottom_of_chain(self):
+        """
+        Moves at the bottom of a 10^6 chain, where the old and new parents
+        meet close by, so the top of the chain is never touched.
+        """
+        root, nodes = make_chain(SIZE)
+        t = tree.Tree(root)
+        leaf = node.Node(SIZE)
+        t.put(nodes[-10], leaf)
+
+        for i in range(10 ** 4):
+            t.move(leaf, nodes[-10 + i % 5])
+
+        assert leaf.parent is nodes[-6], "leaf in the wrong place"
+        assert root.subtree_value == SIZE, \
+            "expected: {}, got: {}".format(SIZE, root.subtree_value)
+        assert root.subtree_size == SIZE + 1, \
+            "expected: {}, got: {}".format(SIZE + 1, root.subtree_size)
+        check_values(nodes[-20])
+
+        t.set_key(leaf, -1)
+        assert root.subtree_value == SIZE - 1, \
+            "expected: {}, got: {}".format(SIZE - 1, root.subtree_value)
+        assert root.subtree_sum == sum(range(SIZE)) - 1, \
+            "expected: {}, got: {}".format(sum(range(SIZE)) - 1,
+                                           root.subtree_sum)
+
+    def test_swap_many_children_of_wide_node(self):
+        """
+        Swaps leaves of a 10^5 child star with leaves of another node; each
+        swap has to unlink a child from the middle of the big list.
+        """
+        root, nodes = make_star(10 ** 5)
+        t = tree.Tree(root)
+        other = nodes[1]
+        leaves = [node.Node(-i) for i in range(100)]
+        for leaf in leaves:
+            t.put(other, leaf)
+
+        rng = random.Random(10)
+        for _ in range(10 ** 4):
+            a = rng.choice(root.children)
+            b = rng.choice(other.children)
+            if a is not other:
+                t.swap(a, b)
+
+        for parent in (root, other):
+            for i, c in enumerate(parent.children):
+                assert c.index_in_parent == i, \
+                    "expected: {}, got: {}".format(i, c.index_in_parent)
+        check_values(root)
+
+    def test_put_under_wide_node_with_aggregates(self):
+        """
+        Puts under the root of a 10^5 child star combine the new child into
+        an aggregate without an inverse, instead of going over all children.
+        """
+        root, nodes = make_star(10 ** 5)
+        t = tree.Tree(root)
+        t.register_aggregate(aggregates.MIN)
+        t.register_aggregate(aggregates.TopK(3))
+
+        reduced = []
+        of_node = aggregates.Aggregate.of_node
+
+        def counted(aggregate, n):
+            reduced.append(n)
+            return of_node(aggregate, n)
+
+        aggregates.Aggregate.of_node = counted
+        try:
+            for i in range(200):
+                t.put(root, node.Node(-i))
+        finally:
+            aggregates.Aggregate.of_node = of_node
+
+        assert root not in reduced, "the root was recomputed from its children"
+        assert t.aggregate(root, "min") == -199, \
+            "expected: {}, got: {}".format(-199, t.aggregate(root, "min"))
+        top = t.aggregate(root, "top3")
+        expected = (10 ** 5 - 1, 10 ** 5 - 2, 10 ** 5 - 3)
+        assert top == expected, "expected: {}, got: {}".format(expected, top)
+
+
+class TraversalTestCase(unittest.TestCase):
+    """
+    The lazy traversal iterators of `Tree`.
+    """
+
+    def test_orders(self):
+        """
+              0
+            / | \
+           1  2  3
+           |     |
+           4     5
+        """
+        t = tree.Tree.from_parent_array([0, 1, 2, 3, 4, 5],
+                                        [-1, 0, 0, 0, 1, 3])
+        keys = lambda it: [n.key for n in it]
+
+        assert keys(t.iter_preorder()) == [0, 1, 4, 2, 3, 5]
+        assert keys(t.iter_postorder()) == [4, 1, 2, 5, 3, 0]
+        assert keys(t.iter_levelorder()) == [0, 1, 2, 3, 4, 5]
+        assert keys(t.iter_subtree(t.root.children[2])) == [3, 5]
+
+    def test_deep_chain(self):
+        root, nodes = make_chain(SIZE)
+        t = tree.Tree(root)
+
+        total = sum(n.key for n in t.iter_postorder())
+        assert total == SIZE * (SIZE - 1) // 2, \
+            "expected: {}, got: {}".format(SIZE * (SIZE - 1) // 2, total)
+
+        first = next(t.iter_preorder())
+        assert first is root
+
+
+class BulkBuildTestCase(unittest.TestCase):
+    """
+    Building whole trees from parent arrays and edge lists.
+    """
+
+    def test_from_parent_array_chain(self):
+        keys = list(range(SIZE))
+        parents = [i - 1 for i in range(SIZE)]
+        t = tree.Tree.from_parent_array(keys, parents)
+
+        assert t.root.key == 0
+        assert t.root.subtree_value == SIZE - 1, \
+            "expected: {}, got: {}".format(SIZE - 1, t.root.subtree_value)
+        assert t.root.subtree_size == SIZE, \
+            "expected: {}, got: {}".format(SIZE, t.root.subtree_size)
+
+    def test_from_edges(self):
+        """
+            1
+           / \
+          7   3
+              |
+              9
+        """
+        t = tree.Tree.from_edges([(1, 7), (1, 3), (3, 9)])
+
+        assert t.root.key == 1
+        assert [c.key for c in t.root.children] == [7, 3]
+        assert t.root.subtree_value == 9, \
+            "expected: {}, got: {}".format(9, t.root.subtree_value)
+        check_values(t.root)
+
+        t.flatten(t.root.children[1])
+        assert t.root.subtree_value == 12, \
+            "expected: {}, got: {}".format(12, t.root.subtree_value)
+
+    def test_bad_parents(self):
+        with self.assertRaises(ValueError):
+            tree.Tree.from_parent_array([1, 2, 3], [-1, 2, 1])
+        with self.assertRaises(ValueError):
+            tree.Tree.from_parent_array([1, 2], [-1, -1])
+
+
+class BatchTestCase(unittest.TestCase):
+    """
+    Bursts of operations below a deep path inside `Tree.batch`.
+    """
+
+    def test_burst_under_deep_chain(self):
+        depth = 10 ** 4
+        t = tree.Tree.from_parent_array(list(range(depth)),
+                                        [i - 1 for i in range(depth)])
+        bottom = t.root
+        while bottom.children:
+            bottom = bottom.children[0]
+
+        # Without batching every put would walk the whole chain.
+        with t.batch():
+            leaves = [node.Node(depth + i) for i in range(depth)]
+            for leaf in leaves:
+                t.put(bottom, leaf)
+            t.flatten(bottom)
+
+        expected = sum(range(2 * depth))
+        assert t.root.subtree_sum == expected, \
+            "expected: {}, got: {}".format(expected, t.root.subtree_sum)
+        assert t.root.subtree_value == bottom.key, \
+            "expected: {}, got: {}".format(bottom.key, t.root.subtree_value)
+        assert t.root.subtree_size == depth, \
+            "expected: {}, got: {}".format(depth, t.root.subtree_size)
+
+
+class LazyTestCase(unittest.TestCase):
+    """
+    Writes below a deep path on a lazy tree.
+    """
+
+    def test_writes_under_deep_chain(self):
+        depth = 10 ** 4
+        t = tree.Tree.from_parent_array(list(range(depth)),
+                                        [i - 1 for i in range(depth)],
+                                        lazy=True)
+        bottom = t.root
+        while bottom.children:
+            bottom = bottom.children[0]
+
+        # Only the first put walks the chain, the rest stop at the bottom.
+        for i in range(depth):
+            t.put(bottom, node.Node(depth + i))
+
+        middle = t.root.children[0].children[0]
+        assert middle.subtree_size == 2 * depth - 2, \
+            "expected: {}, got: {}".format(2 * depth - 2, middle.subtree_size)
+        assert t.root.subtree_value == 2 * depth - 1, \
+            "expected: {}, got: {}".format(2 * depth - 1, t.root.subtree_value)
+
+        t.put(t.root, node.Node(3 * depth))
+        assert t.root.subtree_value == 3 * depth, \
+            "expected: {}, got: {}".format(3 * depth, t.root.subtree_value)
+        assert middle.subtree_value == 2 * depth - 1, \
+            "expected: {}, got: {}".format(2 * depth - 1, middle.subtree_value)
+
+
+class EulerTourLargeTreeTestCase(unittest.TestCase):
+    """
+    Deep trees with the Euler tour backend.
+    """
+
+    def test_swap_in_deep_chain(self):
+        root, nodes = make_chain(10 ** 5)
+        t = tree.Tree(root, backend="euler")
+        leaf = node.Node(-1)
+        t.put(nodes[10], leaf)
+
+        # Swap the bottom half of the chain with a leaf near the top.
+        t.swap(nodes[50000], leaf)
+
+        assert nodes[10].subtree_value == 10 ** 5 - 1, \
+            "expected: {}, got: {}".format(10 ** 5 - 1,
+                                           nodes[10].subtree_value)
+        assert nodes[49999].subtree_value == 49999, \
+            "expected: {}, got: {}".format(49999, nodes[49999].subtree_value)
+        assert nodes[11].subtree_size == 49990, \
+            "expected: {}, got: {}".format(49990, nodes[11].subtree_size)
+
+        with self.assertRaises(ValueError):
+            t.swap(nodes[20], nodes[30])
+
+
+class RandomOperationsTestCase(unittest.TestCase):
+    """
+    Random operations, checked against a full recomputation.
+    """
+
+    backend = None
+
+    def make_tree(self, root):
+        return tree.Tree(root, backend=self.backend)
+
+    def test_random_operations(self):
+        rng = random.Random(2123)
+        t = self.make_tree(node.Node(0))
+
+        run_operations(t, rng, 2000)
+
+        check_values(t.root)
+
+    def test_random_operations_in_batches(self):
+        rng = random.Random(2123)
+        t = self.make_tree(node.Node(0))
+
+        for _ in range(40):
+            with t.batch():
+                run_operations(t, rng, rng.randint(1, 100))
+            check_values(t.root)
+
+
+    def test_random_operations_with_aggregates(self):
+        if self.backend is not None:
+            self.skipTest("aggregates need the default backend")
+        rng = random.Random(99)
+        t = self.make_tree(node.Node(0))
+        run_operations(t, rng, 200)
+
+        squares = aggregates.Aggregate("squares", lambda key: key * key,
+                                       lambda a, b: a + b, 0,
+                                       inverse=lambda a: -a)
+        for a in (aggregates.MIN, aggregates.COUNT, squares):
+            t.register_aggregate(a)
+
+        for _ in range(10):
+            with t.batch():
+                run_operations(t, rng, 20)
+            run_operations(t, rng, 50)
+            check_aggregates(t)
+
+    def test_is_ancestor(self):
+        rng = random.Random(15)
+        t = self.make_tree(node.Node(0))
+        for _ in range(20):
+            run_operations(t, rng, 100)
+            nodes = list(reachable(t.root))
+            for _ in range(200):
+                a, b = rng.choice(nodes), rng.choice(nodes)
+                expected = is_above(a, b)
+                assert t.is_ancestor(a, b) == expected, \
+                    "expected: {}, got: {}".format(expected,
+                                                   t.is_ancestor(a, b))
+
+    def test_jump_queries(self):
+        rng = random.Random(16)
+        t = self.make_tree(node.Node(0))
+        for _ in range(20):
+            run_operations(t, rng, 100)
+            nodes = list(reachable(t.root))
+            for _ in range(50):
+                n = rng.choice(nodes)
+                path = [n]
+                while path[-1] is not t.root:
+                    path.append(path[-1].parent)
+                assert t.depth(n) == len(path) - 1, \
+                    "expected: {}, got: {}".format(len(path) - 1, t.depth(n))
+                k = rng.randrange(len(path))
+                assert t.kth_ancestor(n, k) is path[k], \
+                    "wrong ancestor {} levels up".format(k)
+                best = max(x.key for x in path[:k + 1])
+                assert t.path_max(n, path[k]) == best, \
+                    "expected: {}, got: {}".format(best,
+                                                   t.path_max(n, path[k]))
+
+    def test_flatten_many(self):
+        rng = random.Random(18)
+        t = self.make_tree(node.Node(0))
+        for _ in range(10):
+            run_operations(t, rng, 200)
+            nodes = list(reachable(t.root))
+            picked = rng.sample(nodes, min(len(nodes), 20))
+            total = t.root.subtree_sum
+
+            flattened = t.flatten_many(picked)
+            for n in picked:
+                assert any(n is f or is_above(f, n) for f in flattened), \
+                    "node {} was left out".format(n.key)
+            for n in flattened:
+                assert n.is_external(), "node {} not flattened".format(n.key)
+                assert not any(is_above(f, n) for f in flattened), \
+                    "nested node {} flattened".format(n.key)
+            assert t.root.subtree_sum == total, \
+                "expected: {}, got: {}".format(total, t.root.subtree_sum)
+            check_values(t.root)
+
+    def test_top_k(self):
+        rng = random.Random(22)
+        t = self.make_tree(node.Node(0))
+        if self.backend is None:
+            t.register_aggregate(aggregates.TopK(5))
+        for _ in range(10):
+            run_operations(t, rng, 200)
+            nodes = list(reachable(t.root))
+            for n in rng.sample(nodes, min(len(nodes), 20)):
+                keys = sorted((x.key for x in reachable(n)), reverse=True)
+                for k in (1, 3, 5, 12):
+                    got = t.top_k(n, k)
+                    assert got == keys[:k], \
+                        "expected: {}, got: {}".format(keys[:k], got)
+
+    def test_move_and_set_key(self):
+        rng = random.Random(23)
+        t = self.make_tree(node.Node(0))
+        if self.backend is None:
+            squares = aggregates.Aggregate("squares", lambda key: key * key,
+                                           lambda a, b: a + b, 0,
+                                           inverse=lambda a: -a)
+            for a in (aggregates.MIN, aggregates.COUNT, squares):
+                t.register_aggregate(a)
+        run_operations(t, rng, 300)
+
+        def change(count):
+            nodes = list(reachable(t.root))
+            for _ in range(count):
+                a, b = rng.sample(nodes, 2)
+                if a is not t.root and not is_above(a, b):
+                    t.move(a, b)
+                n = rng.choice(nodes)
+                t.set_key(n, n.key + rng.randint(-60, 60))
+
+        for i in range(20):
+            if i % 2:
+                with t.batch():
+                    change(20)
+            else:
+                change(20)
+            check_values(t.root)
+            if self.backend is None:
+                check_aggregates(t)
+
+        a = t.root.children[0]
+        with self.assertRaises(ValueError):
+            t.move(t.root, a)
+        with self.assertRaises(ValueError):
+            t.move(a, a)
+
+
+class EulerTourRandomOperationsTestCase(RandomOperationsTestCase):
+    """
+    Random operations with the Euler tour backend.
+    """
+
+    backend = "euler"
+
+
+class LazyRandomOperationsTestCase(RandomOperationsTestCase):
+    """
+    Random operations on a lazy tree.
+    """
+
+    def make_tree(self, root):
+        return tree.Tree(root, lazy=True)
+
+
+def check_aggregates(t):
+    """
+    Compares the min, count and sum of squares aggregates of every node in
+    `t` with values computed from scratch.
+    """
+    for n in t.iter_postorder():
+        keys = [x.key for x in t.iter_subtree(n)]
+        expected = (min(keys), len(keys), sum(k * k for k in keys))
+        got = (t.aggregate(n, "min"), t.aggregate(n, "count"),
+               t.aggregate(n, "squares"))
+        assert got == expected, \
+            "expected: {}, got: {}".format(expected, got)
+
+
+def reachable(root):
+    """
+    Yields every node reachable from `root`.
+    """
+    stack = [root]
+    while stack:
+        n = stack.pop()
+        yield n
+        stack.extend(n.children)
+
+
+def is_above(a, b):
+    """
+    Checks whether `a` is a proper ancestor of `b`.
+    """
+    n = b.parent
+    while n is not None:
+        if n is a:
+            return True
+        n = n.parent
+    return False
+
+
+def is_related(a, b):
+    """
+    Checks whether one node is an ancestor of the other.
+    """
+    for x, y in ((a, b), (b, a)):
+        n = y
+        while n is not None:
+            if n is x:
+                return True
+            n = n.parent
+    return False
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+def run_operations(t, rng, count):
+    """
+    Applies `count` random puts, swaps, moves, key changes and flattens to
+    `t`. Some puts add a node with a child, to put a whole subtree at once.
+    """
+    nodes = list(reachable(t.root))
+    for _ in range(count):
+        op = rng.random()
+        if op < 0.5 or len(nodes) < 3:
+            parent = rng.choice(nodes)
+            child = t.new_node(rng.randint(-50, 50))
+            if rng.random() < 0.2:
+                grandchild = t.new_node(rng.randint(-50, 50))
+                child.add_child(grandchild)
+                nodes.append(grandchild)
+            t.put(parent, child)
+            nodes.append(child)
+        elif op < 0.7:
+            a, b = rng.sample(nodes[1:], 2)
+            if not is_related(a, b):
+                t.swap(a, b)
+        elif op < 0.8:
+            a, b = rng.sample(nodes[1:], 2)
+            if not is_above(a, b):
+                t.move(a, b)
+        elif op < 0.9:
+            t.set_key(rng.choice(nodes), rng.randint(-50, 50))
+        else:
+            t.flatten(rng.choice(nodes))
+            nodes = list(reachable(t.root))
@@ -0,0 +1,156 @@
+"""
+Locked tree tests
+-----------------
+
+Shares a tree between reader threads and a writer thread through
+`LockedTree`.
+
+To run this, in the main directory run:
+
+python -m unittest test_locking.py
+
+"""
+import random
+import threading
+import unittest
+
+import locking
+import node
+import tree
+from test_large_trees import check_values, is_related, reachable
+
+
+class RWLockTestCase(unittest.TestCase):
+    """
+    Readers share the lock, writers have it alone.
+    """
+
+    def test_readers_share(self):
+        lock = locking.RWLock()
+        both_in = threading.Barrier(2, timeout=5)
+
+        def reader():
+            lock.acquire_read()
+            try:
+                both_in.wait()
+            finally:
+                lock.release_read()
+
+        threads = [threading.Thread(target=reader) for _ in range(2)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert not both_in.broken, "readers blocked each other"
+
+    def test_writer_excludes_readers(self):
+        lock = locking.RWLock()
+        read = threading.Event()
+
+        def reader():
+            lock.acquire_read()
+            read.set()
+            lock.release_read()
+
+        lock.acquire_write()
+        th = threading.Thread(target=reader)
+        th.start()
+        assert not read.wait(0.2), "reader got in during a write"
+        lock.release_write()
+        th.join()
+        assert read.is_set(), "reader never got in"
+
+
+class LockedTreeTestCase(unittest.TestCase):
+    """
+    Readers never see a half updated tree while a writer changes it.
+    """
+
+    lazy = False
+
+    def test_readers_and_writer(self):
+        # All keys are 1 below a root of 0, so the sum of the root is its
+        # size minus one whatever the shape.
+        shared = locking.LockedTree(tree.Tree(node.Node(0), lazy=self.lazy))
+        root = shared.tree.root
+        done = threading.Event()
+        errors = []
+
+        def writer():
+            rng = random.Random(20)
+            nodes = [root]
+            try:
+                for _ in range(3000):
+                    if rng.random() < 0.7 or len(nodes) < 3:
+                        child = node.Node(1)
+                        shared.put(rng.choice(nodes), child)
+                        nodes.append(child)
+                    else:
+                        a, b = rng.sample(nodes[1:], 2)
+                        if not is_related(a, b):
+                            shared.swap(a, b)
+            finally:
+                done.set()
+
+        def reader():
+            while not done.is_set():
+                with shared.read():
+                    total = root.subtree_sum
+                    size = root.subtree_size
+                if total != size - 1:
+                    errors.append((total, size))
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        threads.append(threading.Thread(target=writer))
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+
+        assert errors == [], "readers saw: {}".format(errors[:5])
+        size = shared.subtree_size(root)
+        assert size == len(list(reachable(root))), \
+            "expected: {}, got: {}".format(len(list(reachable(root))), size)
+        with shared.read():
+            check_values(root)
+
+    def test_queries(self):
+        shared = locking.LockedTree(tree.Tree(node.Node(0), lazy=self.lazy))
+        root = shared.tree.root
+        a = shared.new_node(5)
+        b = shared.new_node(7)
+        shared.put(root, a)
+        shared.put(a, b)
+
+        assert shared.subtree_value(root) == 7, \
+            "expected: {}, got: {}".format(7, shared.subtree_value(root))
+        assert shared.is_ancestor(root, b), "root is above b"
+        assert shared.depth(b) == 2, \
+            "expected: {}, got: {}".format(2, shared.depth(b))
+        assert shared.kth_ancestor(b, 1) is a, "wrong parent"
+        assert shared.path_max(b, root) == 7, \
+            "expected: {}, got: {}".format(7, shared.path_max(b, root))
+
+        c = shared.new_node(1)
+        shared.put(root, c)
+        shared.move(b, c)
+        assert shared.subtree_value(a) == 5, \
+            "expected: {}, got: {}".format(5, shared.subtree_value(a))
+        shared.set_key(b, 6)
+        assert shared.path_max(b, root) == 6, \
+            "expected: {}, got: {}".format(6, shared.path_max(b, root))
+        shared.move(b, a)
+        shared.set_key(c, 0)
+
+        shared.flatten(a)
+        assert shared.subtree_sum(root) == 11, \
+            "expected: {}, got: {}".format(11, shared.subtree_sum(root))
+        assert len(list(reachable(root))) == 3
+
+
+class LazyLockedTreeTestCase(LockedTreeTestCase):
+    """
+    A shared lazy tree, whose reads update it.
+    """
+
+    lazy = True
@@ -0,0 +1,165 @@
+"""
+Operation log tests
+-------------------
+
+Checkpoints trees, changes them, and rebuilds them with `Tree.recover`.
+
+To run this, in the main directory run:
+
+python -m unittest test_oplog.py
+
+"""
+import os
+import random
+import tempfile
+import unittest
+
+import node
+import oplog
+import tree
+from test_large_trees import check_values, run_operations
+
+
+def shape(t):
+    """
+    Returns the keys, parents and values of a tree, node by node in
+    preorder, with parents given as preorder offsets.
+    """
+    order = list(t.iter_preorder())
+    offset = {n: i for i, n in enumerate(order)}
+    return [(n.key, offset.get(n.parent), n.subtree_value, n.subtree_sum,
+             n.subtree_size) for n in order]
+
+
+class OpLogTestCase(unittest.TestCase):
+    """
+    A recovered tree is the tree that was logged.
+    """
+
+    options = {}
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.snap = os.path.join(self.dir.name, "tree.snap")
+        self.log = os.path.join(self.dir.name, "tree.log")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_tree(self):
+        return tree.Tree(node.Node(0), **self.options)
+
+    def test_recover(self):
+        rng = random.Random(24)
+        t = self.make_tree()
+        run_operations(t, rng, 200)
+        t.checkpoint(self.snap, self.log)
+        run_operations(t, rng, 400)
+        t.log.close()
+
+        recovered = tree.Tree.recover(self.snap, self.log, **self.options)
+        expected = shape(t)
+        got = shape(recovered)
+        assert got == expected, "expected: {}, got: {}".format(
+            expected[:5], got[:5])
+        check_values(recovered.root)
+        recovered.log.close()
+
+    def test_recover_keeps_logging(self):
+        rng = random.Random(25)
+        t = self.make_tree()
+        run_operations(t, rng, 100)
+        t.checkpoint(self.snap, self.log)
+        run_operations(t, rng, 100)
+        t.log.close()
+
+        recovered = tree.Tree.recover(self.snap, self.log, **self.options)
+        run_operations(recovered, rng, 100)
+        recovered.log.close()
+
+        again = tree.Tree.recover(self.snap, self.log, **self.options)
+        expected = shape(recovered)
+        got = shape(again)
+        assert got == expected, "expected: {}, got: {}".format(
+            expected[:5], got[:5])
+        again.log.close()
+
+    def test_set_key_is_logged(self):
+        t = self.make_tree()
+        a = t.new_node(5)
+        t.put(t.root, a)
+        t.checkpoint(self.snap, self.log)
+        t.set_key(a, 9)
+        t.log.close()
+
+        recovered = tree.Tree.recover(self.snap, self.log, **self.options)
+        key = recovered.root.children[0].key
+        assert key == 9, "expected: {}, got: {}".format(9, key)
+        assert recovered.root.subtree_sum == 9, \
+            "expected: {}, got: {}".format(9, recovered.root.subtree_sum)
+        recovered.log.close()
+
+    def test_torn_record(self):
+        t = self.make_tree()
+        t.checkpoint(self.snap, self.log)
+        a = t.new_node(5)
+        t.put(t.root, a)
+        before = shape(t)
+        t.set_key(a, 9)
+        t.log.close()
+
+        # Cut the last record short, as a crash halfway through it would.
+        with open(self.log, "rb+") as f:
+            f.truncate(os.path.getsize(self.log) - 3)
+
+        recovered = tree.Tree.recover(self.snap, self.log, **self.options)
+        got = shape(recovered)
+        assert got == before, "expected: {}, got: {}".format(before, got)
+        size = os.path.getsize(self.log)
+        expected_size = oplog.HEADER.size + oplog.RECORD.size
+        assert size == expected_size, \
+            "expected: {}, got: {}".format(expected_size, size)
+        recovered.log.close()
+
+    def test_stale_log(self):
+        t = self.make_tree()
+        t.checkpoint(self.snap, self.log)
+        t.put(t.root, t.new_node(5))
+        t.log.close()
+        stale = self.log + ".old"
+        os.replace(self.log, stale)
+
+        # A crash after the new snapshot was written but before its log.
+        t.checkpoint(self.snap, self.log)
+        t.log.close()
+        os.replace(stale, self.log)
+
+        recovered = tree.Tree.recover(self.snap, self.log, **self.options)
+        expected = shape(t)
+        got = shape(recovered)
+        assert got == expected, "expected: {}, got: {}".format(expected, got)
+        recovered.log.close()
+        _, _, records, _ = oplog.read(self.log)
+        assert records == [], "expected: {}, got: {}".format([], records)
+
+    def test_not_a_log(self):
+        with open(self.log, "wb") as f:
+            f.write(b"\0" * oplog.HEADER.size)
+        with self.assertRaises(ValueError):
+            oplog.read(self.log)
+
+
+class LazyOpLogTestCase(OpLogTestCase):
+    """
+    Logging and recovery of a lazy tree.
+    """
+
+    options = {"lazy": True}
+
+
+class EulerOpLogTestCase(OpLogTestCase):
+    """
+    Logging and recovery with the Euler tour backend.
+    """
+
+    options = {"backend": "euler"}
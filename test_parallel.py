@@ -0,0 +1,79 @@
+"""
+Parallel recompute tests
+------------------------
+
+Recomputes forests with `recompute_all(workers=...)` and compares against
+the single process pass.
+
+To run this, in the main directory run:
+
+python -m unittest test_parallel.py
+
+"""
+import random
+import unittest
+
+import parallel
+import tree
+from test_large_trees import check_values
+
+
+def make_forest(trees, size, seed):
+    """
+    Builds `trees` random trees of about `size` nodes each under a root.
+    :return: (keys, parents) lists for `Tree.from_parent_array`.
+    """
+    rng = random.Random(seed)
+    keys = [0]
+    parents = [-1]
+    for _ in range(trees):
+        top = len(keys)
+        keys.append(rng.randint(-10 ** 6, 10 ** 6))
+        parents.append(0)
+        for i in range(top + 1, top + rng.randint(1, 2 * size)):
+            keys.append(rng.randint(-10 ** 6, 10 ** 6))
+            parents.append(rng.randrange(top, i))
+    return keys, parents
+
+
+def values(t):
+    return [(n.subtree_value, n.subtree_sum, n.subtree_size)
+            for n in t.iter_preorder()]
+
+
+class ParallelTestCase(unittest.TestCase):
+    """
+    Parallel builds and recomputes give the same values as the serial ones.
+    """
+
+    def setUp(self):
+        self.keys, self.parents = make_forest(50, 2000, seed=3)
+
+    def test_recompute_on_processes(self):
+        t = tree.Tree.from_parent_array(self.keys, self.parents)
+        expected = values(t)
+        for n in t.iter_preorder():
+            n.subtree_value = n.subtree_sum = n.subtree_size = 0
+
+        assert t.recompute_all(workers=2) == len(self.keys)
+        assert values(t) == expected, "parallel values differ"
+        check_values(t.root)
+
+    def test_recompute_in_process(self):
+        t = tree.Tree.from_parent_array(self.keys, self.parents)
+        expected = values(t)
+        assert t.recompute_all(workers=1) == len(self.keys)
+        assert values(t) == expected, "values differ with one worker"
+
+    def test_build(self):
+        t = tree.Tree.from_parent_array(self.keys, self.parents, workers=2)
+        expected = tree.Tree.from_parent_array(self.keys, self.parents)
+        assert values(t) == values(expected), "parallel build differs"
+        with self.assertRaises(ValueError):
+            tree.Tree.from_parent_array([1, 2, 3], [-1, 2, 1], workers=2)
+
+    def test_chunks(self):
+        ranges = parallel.chunks([1, 3, 4, 8, 9], 12, 3)
+        assert ranges == [(1, 4), (4, 8), (8, 12)], \
+            "expected: {}, got: {}".format([(1, 4), (4, 8), (8, 12)], ranges)
+        assert parallel.chunks([], 1, 4) == []
@@ -0,0 +1,96 @@
+"""
+Node pool tests
+---------------
+
+Builds and flattens trees that hand their removed nodes to a `NodePool`.
+
+To run this, in the main directory run:
+
+python -m unittest test_pool.py
+
+"""
+import gc
+import random
+import unittest
+
+import pool
+import tree
+from test_large_trees import check_values, reachable
+
+
+class PoolTestCase(unittest.TestCase):
+    """
+    Nodes removed by flatten are cleared and reused.
+    """
+
+    backend = None
+
+    def make_tree(self, key, limit=1 << 20):
+        nodes = pool.NodePool(limit)
+        return tree.Tree(nodes.acquire(key), backend=self.backend, pool=nodes)
+
+    def test_flatten_releases_nodes(self):
+        t = self.make_tree(0)
+        a = t.new_node(1)
+        t.put(t.root, a)
+        below = [t.new_node(i) for i in range(2, 12)]
+        for n in below:
+            t.put(a, n)
+
+        t.flatten(a)
+
+        assert len(t.pool) == 10, \
+            "expected: {}, got: {}".format(10, len(t.pool))
+        for n in below:
+            assert n.parent is None and n.children == [], \
+                "node {} still linked".format(n.key)
+        assert a.key == sum(range(1, 12)), \
+            "expected: {}, got: {}".format(sum(range(1, 12)), a.key)
+
+        reused = t.new_node(50)
+        assert any(reused is n for n in below), "node was not reused"
+        t.put(a, reused)
+        assert t.root.subtree_value == 66, \
+            "expected: {}, got: {}".format(66, t.root.subtree_value)
+        check_values(t.root)
+
+    def test_build_flatten_cycles(self):
+        rng = random.Random(19)
+        t = self.make_tree(0)
+        for _ in range(20):
+            nodes = list(reachable(t.root))
+            for _ in range(500):
+                child = t.new_node(rng.randint(-100, 100))
+                t.put(rng.choice(nodes), child)
+                nodes.append(child)
+            t.flatten_many(rng.sample(nodes, 5))
+            check_values(t.root)
+        assert len(t.pool) > 0, "no nodes were released"
+
+    def test_limit(self):
+        t = self.make_tree(0, limit=3)
+        for i in range(10):
+            t.put(t.root, t.new_node(i))
+        t.flatten(t.root)
+        assert len(t.pool) == 3, \
+            "expected: {}, got: {}".format(3, len(t.pool))
+
+    def test_gc_freeze(self):
+        t = self.make_tree(0)
+        for i in range(100):
+            t.put(t.root, t.new_node(i))
+        t.gc_freeze()
+        try:
+            assert gc.get_freeze_count() > 0, "nothing was frozen"
+        finally:
+            t.gc_unfreeze()
+        assert gc.get_freeze_count() == 0, \
+            "expected: {}, got: {}".format(0, gc.get_freeze_count())
+
+
+class EulerTourPoolTestCase(PoolTestCase):
+    """
+    Node pools with the Euler tour backend.
+    """
+
+    backend = "euler"
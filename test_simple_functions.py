@@ -10,7 +10,9 @@ To run this, in the main directory run:
 python -m unittest tests/test_simple_functions.py
 
 """
+import gc
 import unittest
+import weakref
 
 import node
 import tree
@@ -312,6 +314,212 @@ class SimpleFunctionsTestCase(unittest.TestCase):
         assert node_d.subtree_value == 7, \
             "expected: {}, got: {}".format(7, node_d.subtree_value)
 
+    def test_subtree_sum_and_size(self):
+        """
+        Sum and size are kept up to date by put, swap and flatten.
+
+           r(5)
+           / \
+         A(2) B(10)
+          |
+         C(8)
+        """
+        root = self.tree.root
+        node_a = node.Node(2, root)
+        node_b = node.Node(10, root)
+        node_c = node.Node(8, node_a)
+
+        self.tree.put(root, node_a)
+        self.tree.put(root, node_b)
+        self.tree.put(node_a, node_c)
+
+        assert root.subtree_sum == 25, \
+            "expected: {}, got: {}".format(25, root.subtree_sum)
+        assert root.subtree_size == 4, \
+            "expected: {}, got: {}".format(4, root.subtree_size)
+
+        self.tree.swap(node_b, node_c)
+
+        assert node_a.subtree_sum == 12, \
+            "expected: {}, got: {}".format(12, node_a.subtree_sum)
+        assert root.subtree_sum == 25, \
+            "expected: {}, got: {}".format(25, root.subtree_sum)
+
+        self.tree.flatten(node_a)
+
+        assert node_a.key == 12, "expected: {}, got: {}".format(12, node_a.key)
+        assert root.subtree_size == 3, \
+            "expected: {}, got: {}".format(3, root.subtree_size)
+        assert root.subtree_sum == 25, \
+            "expected: {}, got: {}".format(25, root.subtree_sum)
+
+    def test_move_and_set_key(self):
+        """
+        Moves C from below A(2) to below B(10), then changes its key.
+
+           r(5)
+           |  \
+         A(2) B(10)
+          |
+         C(8)
+        """
+        root = self.tree.root
+        node_a = node.Node(2, root)
+        node_b = node.Node(10, root)
+        node_c = node.Node(8, node_a)
+
+        self.tree.put(root, node_a)
+        self.tree.put(root, node_b)
+        self.tree.put(node_a, node_c)
+        self.tree.move(node_c, node_b)
+
+        assert node_a.subtree_value == 2, \
+            "expected: {}, got: {}".format(2, node_a.subtree_value)
+        assert node_b.subtree_sum == 18, \
+            "expected: {}, got: {}".format(18, node_b.subtree_sum)
+        assert node_a.is_external(), "C is still below A"
+
+        self.tree.set_key(node_c, 20)
+        assert root.subtree_value == 20, \
+            "expected: {}, got: {}".format(20, root.subtree_value)
+        self.tree.set_key(node_c, 1)
+        assert root.subtree_value == 10, \
+            "expected: {}, got: {}".format(10, root.subtree_value)
+        assert root.subtree_sum == 18, \
+            "expected: {}, got: {}".format(18, root.subtree_sum)
+
+    def test_set_key_updates_path_max(self):
+        """
+        Changing a key after a path query gives the new maximum.
+
+           r(5)
+            |
+           A(2)
+            |
+           B(3)
+        """
+        root = self.tree.root
+        node_a = node.Node(2)
+        node_b = node.Node(3)
+        self.tree.put(root, node_a)
+        self.tree.put(node_a, node_b)
+
+        largest = self.tree.path_max(node_b, root)
+        assert largest == 5, "expected: {}, got: {}".format(5, largest)
+        self.tree.set_key(node_a, 8)
+        largest = self.tree.path_max(node_b, root)
+        assert largest == 8, "expected: {}, got: {}".format(8, largest)
+
+    def test_flatten_frees_nodes(self):
+        """
+        Nodes flattened away are not kept alive by the tree.
+
+           r
+           |
+           A
+           |
+           B
+        """
+        root = self.tree.root
+        node_a = node.Node(2)
+        node_b = node.Node(3)
+        self.tree.put(root, node_a)
+        self.tree.put(node_a, node_b)
+        freed = weakref.ref(node_b)
+        del node_b
+
+        self.tree.flatten(node_a)
+        gc.collect()
+
+        assert freed() is None, "B is still alive"
+        assert root.subtree_sum == 10, \
+            "expected: {}, got: {}".format(10, root.subtree_sum)
+
+    def test_flatten_frees_toured_nodes(self):
+        """
+        Nodes flattened away after an ancestor query are not kept alive by
+        the tour kept for it.
+        """
+        root = self.tree.root
+        node_a = node.Node(2)
+        node_b = node.Node(3)
+        self.tree.put(root, node_a)
+        self.tree.put(node_a, node_b)
+        assert self.tree.is_ancestor(node_a, node_b), "A is above B"
+        freed = weakref.ref(node_b)
+        del node_b
+
+        self.tree.flatten(node_a)
+        gc.collect()
+
+        assert freed() is None, "B is still alive"
+        assert not self.tree.is_ancestor(node_a, root), "A is above the root"
+
+    def test_swap_with_itself(self):
+        """
+        Swapping a subtree with itself leaves the tree as it was.
+
+            root
+            /  \
+           A    B
+        """
+        root = self.tree.root
+        node_a = node.Node(2)
+        node_b = node.Node(4)
+        self.tree.put(root, node_a)
+        self.tree.put(root, node_b)
+
+        self.tree.swap(node_a, node_a)
+
+        assert root.children == [node_a, node_b], \
+            "expected: {}, got: {}".format([node_a, node_b], root.children)
+        assert node_a.parent is root, "A lost its parent"
+        assert root.subtree_value == 5, \
+            "expected: {}, got: {}".format(5, root.subtree_value)
+        assert root.subtree_sum == 11, \
+            "expected: {}, got: {}".format(11, root.subtree_sum)
+        assert root.subtree_size == 3, \
+            "expected: {}, got: {}".format(3, root.subtree_size)
+
+
+class EulerTourSimpleFunctionsTestCase(SimpleFunctionsTestCase):
+    """
+    Runs the same tests with the Euler tour backend.
+    """
+
+    def setUp(self):
+        root = node.Node(5, None)
+        self.tree = tree.Tree(root, backend="euler")
+
+    def test_tour_swap_with_itself(self):
+        """
+        The tour itself also leaves the tree as it was.
+        """
+        root = self.tree.root
+        node_a = node.Node(2)
+        node_b = node.Node(4)
+        self.tree.put(root, node_a)
+        self.tree.put(root, node_b)
+
+        self.tree.backend.swap(node_a, node_a)
+
+        assert root.children == [node_a, node_b], \
+            "expected: {}, got: {}".format([node_a, node_b], root.children)
+        assert root.subtree_size == 3, \
+            "expected: {}, got: {}".format(3, root.subtree_size)
+        assert root.subtree_sum == 11, \
+            "expected: {}, got: {}".format(11, root.subtree_sum)
+
+
+class LazySimpleFunctionsTestCase(SimpleFunctionsTestCase):
+    """
+    Runs the same tests on a lazy tree.
+    """
+
+    def setUp(self):
+        root = node.Node(5, None)
+        self.tree = tree.Tree(root, lazy=True)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,107 @@
+"""
+Snapshot tests
+--------------
+
+Saves trees with `Tree.save` and loads them back with `Tree.load`.
+
+To run this, in the main directory run:
+
+python -m unittest test_snapshot.py
+
+"""
+import os
+import tempfile
+import unittest
+
+import node
+import tree
+from test_large_trees import check_values
+
+
+class SnapshotTestCase(unittest.TestCase):
+    """
+    Round trips through the binary snapshot format.
+    """
+
+    def setUp(self):
+        """
+        Builds:
+
+                r(5)
+              /  |   \
+            A(4) B(9) C(6)
+            |        /  \
+            D(7)   E(1)  F(2)
+        """
+        root = node.Node(5)
+        self.tree = tree.Tree(root)
+        self.nodes = {}
+        for name, key, parent in [("A", 4, root), ("B", 9, root),
+                                  ("C", 6, root), ("D", 7, "A"),
+                                  ("E", 1, "C"), ("F", 2, "C")]:
+            if isinstance(parent, str):
+                parent = self.nodes[parent]
+            self.nodes[name] = node.Node(key)
+            self.tree.put(parent, self.nodes[name])
+
+        handle, self.path = tempfile.mkstemp(suffix=".snap")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        self.tree.save(self.path)
+
+        for use_mmap in (True, False):
+            loaded = tree.Tree.load(self.path, mmap=use_mmap)
+
+            assert len(loaded) == 7, \
+                "expected: {}, got: {}".format(7, len(loaded))
+            assert [c.key for c in loaded.root.children] == [4, 9, 6]
+            assert loaded.root.subtree_value == 9, \
+                "expected: {}, got: {}".format(9, loaded.root.subtree_value)
+            c = loaded.root.children[2]
+            assert [x.key for x in c.children] == [1, 2]
+            assert c.parent == loaded.root
+
+    def test_loaded_tree_can_change(self):
+        self.tree.save(self.path)
+        loaded = tree.Tree.load(self.path, mmap=True)
+
+        c = loaded.root.children[2]
+        loaded.put(c, loaded.new_node(20))
+        loaded.flatten(c)
+
+        assert c.key == 29, "expected: {}, got: {}".format(29, c.key)
+        assert loaded.root.subtree_value == 29, \
+            "expected: {}, got: {}".format(29, loaded.root.subtree_value)
+
+        # The file itself is not changed.
+        again = tree.Tree.load(self.path, mmap=True)
+        assert again.root.children[2].key == 6
+
+    def test_to_tree(self):
+        self.tree.save(self.path)
+        rebuilt = tree.Tree.load(self.path).to_tree()
+
+        assert rebuilt.root.subtree_sum == 34, \
+            "expected: {}, got: {}".format(34, rebuilt.root.subtree_sum)
+        check_values(rebuilt.root)
+
+    def test_deep_chain(self):
+        depth = 10 ** 5
+        t = tree.Tree.from_parent_array(list(range(depth)),
+                                        [i - 1 for i in range(depth)])
+        t.save(self.path)
+        loaded = tree.Tree.load(self.path)
+
+        assert loaded.root.subtree_value == depth - 1, \
+            "expected: {}, got: {}".format(depth - 1,
+                                           loaded.root.subtree_value)
+        loaded.save(self.path)
+        assert tree.Tree.load(self.path).to_tree().root.subtree_size == depth
+
+
+if __name__ == '__main__':
+    unittest.main()
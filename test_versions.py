@@ -0,0 +1,147 @@
+"""
+Version tests
+-------------
+
+Takes versions with `Tree.snapshot` and checks that later changes do not
+show through them.
+
+To run this, in the main directory run:
+
+python -m unittest test_versions.py
+
+"""
+import random
+import unittest
+
+import aggregates
+import node
+import pool
+import tree
+from test_large_trees import (check_values, make_chain, reachable,
+                              run_operations)
+
+
+def picture(version):
+    """
+    Returns everything a version shows, node by node in preorder.
+    """
+    return [(n, version.key(n), version.subtree_value(n),
+             version.subtree_sum(n), version.subtree_size(n))
+            for n in version.iter_preorder()]
+
+
+def current(t):
+    return [(n, n.key, n.subtree_value, n.subtree_sum, n.subtree_size)
+            for n in t.iter_preorder()]
+
+
+class VersionTestCase(unittest.TestCase):
+    """
+    Versions keep showing the tree as it was.
+    """
+
+    lazy = False
+
+    def make_tree(self, **options):
+        return tree.Tree(node.Node(0), lazy=self.lazy, **options)
+
+    def test_simple(self):
+        t = self.make_tree()
+        a = node.Node(5)
+        t.put(t.root, a)
+        version = t.snapshot()
+
+        t.put(a, node.Node(9))
+        t.flatten(a)
+
+        assert version.subtree_value(t.root) == 5, \
+            "expected: {}, got: {}".format(5, version.subtree_value(t.root))
+        assert version.children(a) == [], "new child shows in the version"
+        assert version.key(a) == 5, \
+            "expected: {}, got: {}".format(5, version.key(a))
+        assert t.root.subtree_value == 14, \
+            "expected: {}, got: {}".format(14, t.root.subtree_value)
+
+        version.release()
+        with self.assertRaises(ValueError):
+            version.key(a)
+        assert a.history is None, "history kept after release"
+
+    def test_set_key(self):
+        t = self.make_tree()
+        a = node.Node(5)
+        t.put(t.root, a)
+        version = t.snapshot()
+
+        t.set_key(a, 9)
+
+        assert version.key(a) == 5, \
+            "expected: {}, got: {}".format(5, version.key(a))
+        assert version.subtree_sum(t.root) == 5, \
+            "expected: {}, got: {}".format(5, version.subtree_sum(t.root))
+        assert t.root.subtree_value == 9, \
+            "expected: {}, got: {}".format(9, t.root.subtree_value)
+        version.release()
+
+    def test_random_versions(self):
+        rng = random.Random(21)
+        t = self.make_tree(pool=pool.NodePool())
+        t.register_aggregate(aggregates.MIN)
+        taken = []
+        for _ in range(15):
+            run_operations(t, rng, 100)
+            version = t.snapshot()
+            taken.append((version, current(t),
+                          {n: n.aggregates["min"] for n in reachable(t.root)}))
+
+            if len(taken) > 4:
+                old, _, _ = taken.pop(rng.randrange(len(taken)))
+                old.release()
+
+            for version, expected, mins in taken:
+                assert picture(version) == expected, \
+                    "version {} changed".format(version.number)
+                for n, m in mins.items():
+                    assert version.aggregate(n, "min") == m, \
+                        "expected: {}, got: {}".format(
+                            m, version.aggregate(n, "min"))
+        check_values(t.root)
+
+        for version, _, _ in taken:
+            version.release()
+        assert all(n.history is None for n in reachable(t.root)), \
+            "history kept after release"
+
+    def test_path_saving(self):
+        """
+        Changes at the bottom of a 10^4 chain save each node once per version.
+        """
+        root, nodes = make_chain(10 ** 4)
+        t = tree.Tree(root, lazy=self.lazy)
+
+        with t.snapshot() as version:
+            for i in range(100):
+                t.put(nodes[-1], node.Node(10 ** 5 + i))
+            assert all(len(n.history) == 1 for n in nodes), \
+                "nodes saved more than once"
+            assert version.subtree_value(t.root) == 10 ** 4 - 1, \
+                "expected: {}, got: {}".format(10 ** 4 - 1,
+                                               version.subtree_value(t.root))
+        assert t.root.subtree_value == 10 ** 5 + 99, \
+            "expected: {}, got: {}".format(10 ** 5 + 99, t.root.subtree_value)
+
+    def test_no_snapshot_in_batch(self):
+        if self.lazy:
+            self.skipTest("lazy trees do not batch")
+        t = self.make_tree()
+        with t.batch():
+            with self.assertRaises(ValueError):
+                t.snapshot()
+
+
+class LazyVersionTestCase(VersionTestCase):
+    """
+    Versions of a lazy tree.
+    """
+
+    lazy = True
@@ -9,7 +9,20 @@ This is the main file for the interaction of tests.
 
 Your task is to implement the methods for put and flatten.
 """
+from collections import deque
+from contextlib import contextmanager
+import gc
+import heapq
+
+import aggregates
+import eulertour
+import frozen
 import node
+import oplog
+import parallel
+import snapshot
+import versions
+
 
 class Tree:
     """
@@ -19,18 +32,390 @@ class Tree:
 
     Each node in the tree is type <class Node> defined in `node.py`.
 
-    - Init: Sets up the tree with the specified root node.
+    - Init: Sets up the tree with the specified root node, and optionally
+      the backend used to keep the subtree values.
     - put(node, child): Adds the child node to the specified node in the tree.
     - flatten(node): flatten the node.
+    - flatten_many(nodes): flatten several nodes in one pass.
+    - new_node(key): Make a node, reusing one from the pool if there is one.
+    - gc_freeze() / gc_unfreeze(): Keep the garbage collector off the tree.
     - swap(subtree_a, subtree_b): Swap the position of the subtrees.
+    - move(subtree, new_parent): Move a subtree under another node.
+    - set_key(node, value): Change the key of a node.
+    - from_parent_array(keys, parents) / from_edges(edges): Build a whole
+      tree at once.
+    - recompute_all(): Recompute every subtree value from scratch,
+      optionally on several processes.
+    - batch(): Context in which put, flatten and swap defer their updates.
+    - save(path) / load(path): Write and read binary snapshots.
+    - checkpoint(path, log_path) / recover(path, log_path): Log every change
+      after a snapshot, and rebuild the tree from both after a crash.
+    - freeze(): Take a read-only copy with O(1) subtree queries.
+    - snapshot(): Take a read-only version in O(1) that later changes do
+      not affect.
+    - iter_preorder(), iter_postorder(), iter_levelorder(), iter_subtree(node):
+      Walk the tree lazily.
+    - is_ancestor(a, b): Check if `a` is above `b`, in O(log n).
+    - depth(node), kth_ancestor(node, k), path_max(node, ancestor): Queries
+      along the path to the root, in O(log n).
+    - top_k(node, k): The `k` largest keys of a subtree.
+    - register_aggregate(aggregate) / aggregate(node, name): Keep extra
+      subtree aggregates such as min or count (see `aggregates.py`).
+
+    With `lazy=True` the updates are always deferred, and a subtree value is
+    only worked out when it is read.
     """
 
-    def __init__(self, root):
+    def __init__(self, root, backend=None, lazy=False, pool=None):
         """
         Initialises the tree with a root node.
         :param root: the root node.
+        :param backend: None to keep the subtree values on the nodes, or
+            "euler" to keep them in an Euler tour tree (see `eulertour.py`),
+            which makes swap and subtree queries O(log n) for deep trees.
+        :param lazy: If True, put, flatten and swap only mark the changed
+            nodes dirty, and reading `subtree_value` (or the sum or size)
+            recomputes just the dirty part below that node.
+        :param pool: A `pool.NodePool`. Nodes removed by flatten are cleared
+            and handed to it, and `new_node` takes nodes from it.
         """
         self.root = root
+        self.pool = pool
+
+        # While batching (or always, when lazy), maps each dirty node to
+        # [sum change, size change, set of dirty children]. Every ancestor of
+        # a dirty node is dirty.
+        self._dirty = None
+        self._batch_depth = 0
+        self._lazy = None
+        self._aggregates = []
+
+        # The `eulertour.TourOrder` that answers `is_ancestor`. Built on
+        # first use, then kept up to date by every change.
+        self._order = None
+
+        # Maps each node to (depth, ancestors, maxima) jump tables, see
+        # `kth_ancestor`. Built on first use, None while out of date.
+        self._jumps = None
+
+        # Number of the next version handed out by `snapshot`, the numbers
+        # of the versions not yet released, and the nodes with a history.
+        self._version = 0
+        self._live_versions = set()
+        self._saved = set()
+
+        # The `oplog.OpLog` changes are appended to, see `checkpoint`.
+        self.log = None
+
+        if backend is None:
+            self.backend = None
+        elif backend == "euler":
+            if lazy:
+                raise ValueError("the euler backend cannot be lazy")
+            self.backend = eulertour.EulerTour(root)
+        else:
+            raise ValueError("unknown backend: {}".format(backend))
+
+        if lazy:
+            self._dirty = {}
+            self._lazy = LazyValues(self)
+            self._adopt(root)
+
+    @classmethod
+    def from_parent_array(cls, keys, parents, workers=None, **options):
+        """
+        Builds a tree from parallel lists of keys and parent indices. Every
+        node is linked first, and the subtree values are then computed in a
+        single pass, instead of bubbling up once per node.
+        :param keys: The key of each node.
+        :param parents: The index of the parent of each node, -1 (or None)
+            for the root. Children keep the order of their indices.
+        :param workers: If given, compute the subtree values on this many
+            processes (see `parallel.py`).
+        :param options: Passed on to `Tree`, e.g. `backend` or `lazy`.
+        :return: The new tree.
+        """
+        if len(keys) != len(parents):
+            raise ValueError("keys and parents must be the same length")
+
+        nodes = [node.Node(k) for k in keys]
+        root = None
+        for i, p in enumerate(parents):
+            if p is None or p < 0:
+                if root is not None:
+                    raise ValueError("more than one root")
+                root = nodes[i]
+            else:
+                nodes[p].link_child(nodes[i])
+        if root is None:
+            raise ValueError("no root")
+
+        t = cls(root)
+        if t.recompute_all(workers=workers) != len(nodes):
+            raise ValueError("parents do not form a single tree")
+        if options:
+            t = cls(root, **options)
+        return t
+
+    @classmethod
+    def from_edges(cls, edges, keys=None, **options):
+        """
+        Builds a tree from (parent, child) pairs of node ids.
+        :param edges: Iterable of (parent id, child id) pairs. Children keep
+            the order in which they first appear.
+        :param keys: Mapping from node id to key. By default the id is used
+            as the key.
+        :param options: Passed on to `Tree`, e.g. `backend` or `lazy`.
+        :return: The new tree.
+        """
+        index = {}
+        parents = []
+        ids = []
+
+        def lookup(i):
+            if i not in index:
+                index[i] = len(ids)
+                ids.append(i)
+                parents.append(-1)
+            return index[i]
+
+        for p, c in edges:
+            p = lookup(p)
+            c = lookup(c)
+            if parents[c] != -1:
+                raise ValueError("node {} has two parents".format(ids[c]))
+            parents[c] = p
+
+        if keys is None:
+            keys = ids
+        else:
+            keys = [keys[i] for i in ids]
+
+        return cls.from_parent_array(keys, parents, **options)
+
+    def save(self, path):
+        """
+        Writes the tree to a binary snapshot file (see `snapshot.py`). Keys
+        must fit in 64 bits.
+        :param path: The file to write.
+        """
+        snapshot.save(self, path)
+
+    @staticmethod
+    def load(path, mmap=True):
+        """
+        Loads a snapshot written by `save`. No `Node` objects are created:
+        the result is a `compact.CompactTree` over the arrays in the file,
+        which supports put, flatten and swap as well. Use its `to_tree()` to
+        get `Node` objects back.
+        :param path: The file to read.
+        :param mmap: If True, map the file instead of reading it.
+        :return: A `compact.CompactTree`.
+        """
+        return snapshot.load(path, mmap=mmap)
+
+    def checkpoint(self, path, log_path):
+        """
+        Writes a snapshot of the tree to `path`, and from then on appends
+        every put, flatten, swap, move and set_key to the log at `log_path`
+        (see `oplog.py`). Any earlier log is closed and started afresh.
+        :param path: The snapshot file.
+        :param log_path: The log file.
+        """
+        oplog.checkpoint(self, path, log_path)
+
+    @staticmethod
+    def recover(path, log_path, **options):
+        """
+        Rebuilds a tree from a snapshot written by `checkpoint` and replays
+        the changes logged since, in one batch. The tree keeps logging to
+        `log_path`.
+        :param path: The snapshot file.
+        :param log_path: The log file.
+        :param options: Passed on to `Tree`.
+        :return: The recovered `Tree`.
+        """
+        return oplog.recover(path, log_path, **options)
+
+    def snapshot(self):
+        """
+        Takes a read-only version of the tree as it is now, in O(1) (see
+        `versions.py`). Later changes save the old state of the nodes they
+        touch, one root path at a time, for as long as the version lives.
+        :return: A `versions.Version`; call its `release()` when done.
+        """
+        if self.backend is not None:
+            raise ValueError("snapshots need the default backend")
+        if self._batch_depth:
+            raise ValueError("cannot take a snapshot inside a batch")
+        if self._lazy is not None:
+            # Saved states must hold up to date values.
+            self._lazy._settle(self.root)
+
+        number = self._version
+        self._version += 1
+        self._live_versions.add(number)
+        return versions.Version(self, number)
+
+    def _save(self, n):
+        """
+        Saves the state of `n` before it is changed, unless that was already
+        done since the last version was taken.
+        :return: False if it was already saved.
+        """
+        history = n.history
+        if history is not None and history[-1][0] == self._version:
+            return False
+        if history is None:
+            n.history = history = []
+            self._saved.add(n)
+        else:
+            self._prune_history(history)
+        history.append((self._version, versions.state_of(n)))
+        return True
+
+    def _save_path(self, n):
+        """
+        Saves `n` and its ancestors. Once a node was saved for this version
+        all of its ancestors were too, so the walk stops there.
+        """
+        while n is not None and self._save(n):
+            n = n.parent
+
+    def _prune_history(self, history):
+        """
+        Drops the entries of a node's history that no live version reads.
+        An entry is read by the versions from the entry before it up to its
+        own number.
+        """
+        live = self._live_versions
+        keep = []
+        low = 0
+        for entry in history:
+            if any(low <= v < entry[0] for v in live):
+                keep.append(entry)
+            low = entry[0]
+        history[:] = keep
+
+    def _release_version(self, number):
+        """
+        Forgets one live version. Once none are left, every history goes.
+        """
+        self._live_versions.discard(number)
+        if not self._live_versions:
+            for n in self._saved:
+                n.history = None
+            self._saved.clear()
+
+    def freeze(self):
+        """
+        Takes a read-only copy of the tree that answers subtree size, sum
+        and max in O(1) (see `frozen.py`). Use its `thaw()` to get a
+        mutable tree back.
+        :return: A `frozen.FrozenTree`.
+        """
+        return frozen.FrozenTree(self.root)
+
+    def iter_preorder(self, node=None):
+        """
+        Yields every node, parents before children. Only one iterator per
+        level is kept, so the extra memory is O(depth).
+        :param node: Where to start, the root by default.
+        """
+        top = self.root if node is None else node
+        yield top
+        stack = [iter(top.children)]
+        while stack:
+            n = next(stack[-1], None)
+            if n is None:
+                stack.pop()
+                continue
+            yield n
+            stack.append(iter(n.children))
+
+    def iter_postorder(self, node=None):
+        """
+        Yields every node, children before parents, using O(depth) memory.
+        :param node: Where to start, the root by default.
+        """
+        top = self.root if node is None else node
+        stack = [(top, iter(top.children))]
+        while stack:
+            n, children = stack[-1]
+            c = next(children, None)
+            if c is None:
+                stack.pop()
+                yield n
+            else:
+                stack.append((c, iter(c.children)))
+
+    def iter_levelorder(self, node=None):
+        """
+        Yields every node one level at a time. This has to hold a whole
+        level, so its memory is O(width) rather than O(depth).
+        :param node: Where to start, the root by default.
+        """
+        top = self.root if node is None else node
+        queue = deque([top])
+        while queue:
+            n = queue.popleft()
+            yield n
+            queue.extend(n.children)
+
+    def iter_subtree(self, node):
+        """
+        Yields the nodes of the subtree rooted at `node`, in preorder.
+        :param node: The root of the subtree.
+        """
+        return self.iter_preorder(node)
+
+    def recompute_all(self, workers=None):
+        """
+        Recomputes the subtree value, sum and size of every node with one
+        walk down the tree and one pass back up, without recursion. (For a
+        vectorized version, see `compact.CompactTree.recompute_all`.)
+        :param workers: If given, split the work over this many processes,
+            one group of the root's children each (see `parallel.py`).
+        :return: The number of nodes in the tree.
+        """
+        if workers is not None:
+            count = parallel.recompute(self, workers)
+        else:
+            count = self._recompute_python()
+
+        if self._aggregates:
+            for n in self.iter_postorder():
+                self._compute_aggregates(n)
+        if self._dirty is not None:
+            self._dirty.clear()
+        return count
+
+    def _recompute_python(self):
+        """
+        The plain version of `recompute_all`.
+        :return: The number of nodes in the tree.
+        """
+        order = []
+        stack = [self.root]
+        while stack:
+            n = stack.pop()
+            n._subtree_value = n.key
+            n._subtree_sum = n.key
+            n._subtree_size = 1
+            n.child_values = None
+            order.append(n)
+            stack.extend(n.children)
+
+        # Every node comes after its parent in `order`, so going backwards
+        # each node is finished before it is added to its parent.
+        for n in reversed(order):
+            p = n.parent
+            if p is not None and n is not self.root:
+                if n._subtree_value > p._subtree_value:
+                    p._subtree_value = n._subtree_value
+                p._subtree_sum += n._subtree_sum
+                p._subtree_size += n._subtree_size
+        return len(order)
 
     def put(self, node, child):
         """
@@ -38,9 +423,30 @@ class Tree:
         :param node: The node currently in the tree.
         :param child: The child to add to the tree.
         """
-        child.parent = node
-        node.add_child(child)
+        if self._live_versions:
+            self._save(child)
+            self._save_path(node)
+
+        if self.backend is not None:
+            self.backend.put(node, child)
+        else:
+            if self._aggregates:
+                for n in self.iter_postorder(child):
+                    self._compute_aggregates(n)
+            self._add(node, child)
+            if self._order is not None:
+                self._order.put(node, child)
+            if self._lazy is not None:
+                self._adopt(child)
 
+        if self._jumps is not None:
+            if child in self._jumps:
+                # The subtree was moved here from elsewhere.
+                self._jumps = None
+            else:
+                self._jump_tables(child)
+        if self.log is not None:
+            self.log.put(node, child)
 
     def flatten(self, node):
         """
@@ -68,34 +474,124 @@ class Tree:
         D(2)
 
         """
+        self._jumps = None
+        if self._live_versions:
+            self._save_path(node)
+        detached = node.children
+        if self._order is not None:
+            self._order.flatten(node)
+        self._flatten(node)
+        if detached and not node.children and self.pool is not None:
+            self._release(detached)
+        if self.log is not None:
+            self.log.flatten(node)
+
+    def _flatten(self, node):
+        """
+        Does the work of `flatten`.
+        """
+        if self.backend is not None:
+            self.backend.flatten(node)
+            return
+
         if node.is_external():
             return
 
-        total = node.countKey(node) #RECURSION FUNCTION THAT
-                                    #RETURNS AN ARRAY OF ALL KEYS
-        t = 0
-        i = 0
-        while i < len(total): 
-            t += total[i]
-            i+=1
+        if self._dirty is not None:
+            # Bring the sum of this subtree up to date before using it.
+            if node in self._dirty:
+                self._clean(node)
+            total = node._subtree_sum
+            self._mark(node, 0, 1 - node._subtree_size)
+            node.children = []
+            node.child_values = None
+            node.key = total
+            return
 
-        #DELETING CHILD NODES
-        while len(node.children) != 0:
-            del node.children[0]
+        # The sum is maintained on every node, so the new key is already
+        # known. Only the size of the ancestors changes.
+        total = node.subtree_sum
+        node.add_to_path(0, 1 - node.subtree_size)
 
-        node.key = t
-        node.subtree_value = t
+        # Detach the children in one go.
+        node.children = []
+        node.child_values = None
 
-        #CHANGE ALL PARENTS SUBTREE VALUES
-        n = node
-        nval = n.subtree_value
+        node.key = total
+        node.refresh_value()
 
-        while n.parent != None:
-            if n.parent.subtree_value < nval:
-                n.parent.subtree_value = nval
-            n = n.parent
+        if self._aggregates:
+            old = dict(node.aggregates)
+            self._compute_aggregates(node)
+            self._aggregate_walk(node.parent, [
+                a.difference(node.aggregates[a.name], old[a.name])
+                if a.inverse is not None else None
+                for a in self._aggregates])
+
+    def new_node(self, key):
+        """
+        Returns a new node for this tree, taken from the pool if there is
+        one.
+        :param key: The key of the node.
+        """
+        if self.pool is not None:
+            return self.pool.acquire(key)
+        return node.Node(key)
+
+    def _release(self, tops):
+        """
+        Hands the nodes under `tops`, which just left the tree, to the pool.
+        """
+        stack = list(tops)
+        while stack:
+            n = stack.pop()
+            stack.extend(n.children)
+            if self._live_versions:
+                self._save(n)
+            self.pool.release(n)
+
+    @staticmethod
+    def gc_freeze():
+        """
+        Collects garbage once, then moves every object allocated so far,
+        the nodes of long-lived trees included, out of the garbage
+        collector's reach, so later collections do not walk them again. This
+        affects the whole process; `gc_unfreeze` undoes it.
+        """
+        gc.collect()
+        gc.freeze()
 
+    @staticmethod
+    def gc_unfreeze():
+        """
+        Puts the objects moved away by `gc_freeze` back under the garbage
+        collector.
+        """
+        gc.unfreeze()
 
+    def flatten_many(self, nodes):
+        """
+        Flattens several subtrees at once. Nodes inside another requested
+        subtree are dropped, since flattening the outer one removes them
+        anyway. The remaining subtrees are disjoint, so each key is summed
+        only once, and they are flattened in one batch (see `batch`), so
+        the ancestors they share are updated in a single pass.
+        :param nodes: Iterable of nodes in the tree.
+        :return: The nodes that were flattened, in reverse DFS order.
+        """
+        tops = []
+        for n in sorted(set(nodes), key=self._dfs_position):
+            # In a DFS order, a node inside any kept subtree is inside the
+            # last one kept.
+            if tops and self.is_ancestor(tops[-1], n):
+                continue
+            tops.append(n)
+        tops.reverse()
+
+        with self.batch():
+            for n in tops:
+                self.flatten(n)
+        return tops
 
     def swap(self, subtree_a, subtree_b):
         """
@@ -119,51 +615,607 @@ class Tree:
         J  K   D
         """
 
-        if subtree_a.parent == None or subtree_b.parent == None:
+        if subtree_a is subtree_b:
+            return
+        self._jumps = None
+        if self.backend is not None:
+            self.backend.swap(subtree_a, subtree_b)
+            if self.log is not None:
+                self.log.swap(subtree_a, subtree_b)
             return
 
-        temp = subtree_a.parent
+        parent_a = subtree_a.parent
+        parent_b = subtree_b.parent
+        if parent_a is None or parent_b is None:
+            return
+        if self.is_ancestor(subtree_a, subtree_b) or \
+                self.is_ancestor(subtree_b, subtree_a):
+            raise ValueError("cannot swap a subtree with its own descendant")
+        if self._live_versions:
+            self._save(subtree_a)
+            self._save(subtree_b)
+            self._save_path(parent_a)
+            self._save_path(parent_b)
 
-        subtree_a.parent = subtree_b.parent #CHANGE A PARENT TO B PARENT
-        subtree_b.parent.add_child(subtree_a) #ADD CHILD
-        subtree_b.parent.children.remove(subtree_b) #REMOVE EXISTING CHILD
-        temp.add_child(subtree_b) #ADD CHILD
-        temp.children.remove(subtree_a) #REMOVE EXISTING CHILD
-        subtree_b.parent = temp #CHANGE B PARENT TO A
+        # Each move updates the values along the parent's path, and stops
+        # once a node's subtree value no longer changes.
+        self._remove(parent_a, subtree_a)
+        self._remove(parent_b, subtree_b)
+        self._add(parent_a, subtree_b)
+        self._add(parent_b, subtree_a)
+        if self._order is not None:
+            self._order.put(parent_b, subtree_a)
+            self._order.put(parent_a, subtree_b)
+        if self.log is not None:
+            self.log.swap(subtree_a, subtree_b)
 
-        #UPDATING SUBTREE VALUES
+    def move(self, subtree, new_parent):
+        """
+        Moves `subtree` to be the last child of `new_parent`. Sums and sizes
+        are only updated up to the lowest common ancestor of the old and new
+        parents, above which they do not change, and subtree values stop at
+        the first node that keeps its value.
+        :param subtree: The root of the subtree to move.
+        :param new_parent: The node to move it under; not inside `subtree`.
+        """
+        old_parent = subtree.parent
+        if old_parent is None:
+            raise ValueError("cannot move the root")
 
-        n = subtree_a
+        if self.backend is not None:
+            self.backend.move(subtree, new_parent)
+        else:
+            self._move(subtree, old_parent, new_parent)
+        self._jumps = None
+        if self.log is not None:
+            self.log.move(subtree, new_parent)
 
-        while n.parent != None:
-            if n.parent.subtree_value <= n.subtree_value:
-                n.parent.subtree_value = n.subtree_value
-            else:
-                if n.parent.parent == None:
-                    break
-                else:
-                    if n.parent.subtree_value != n.parent.key:
-                        if n.parent.key < n.subtree_value:
-                            n.parent.subtree_value = n.subtree_value
-                        else:
-                            n.parent.subtree_value = n.parent.key
+    def _move(self, subtree, old_parent, new_parent):
+        """
+        Does the work of `move` for the default backend. The common ancestor
+        is found by walking up from both parents, which also shows whether
+        `new_parent` is inside `subtree`, so nothing here costs more than
+        the length of the two paths.
+        """
+        lca, old_path, new_path = self._meet(old_parent, new_parent)
+        if any(n is subtree for n in new_path):
+            raise ValueError("cannot move a subtree below itself")
 
-            n = n.parent
+        if self._live_versions:
+            self._save(subtree)
+            self._save_path(old_parent)
+            self._save_path(new_parent)
 
+        if self._dirty is not None:
+            self._remove(old_parent, subtree)
+            self._add(new_parent, subtree)
+            if self._order is not None:
+                self._order.put(new_parent, subtree)
+            return
 
-        n = subtree_b
+        old_parent.unlink_child(subtree)
+        if old_parent.child_values is not None:
+            old_parent.child_values.remove(subtree._subtree_value)
+        new_parent.link_child(subtree)
+        if new_parent.child_values is not None:
+            new_parent.child_values.add(subtree._subtree_value)
+        if self._order is not None:
+            self._order.put(new_parent, subtree)
 
-        while n.parent != None:
-            if n.parent.subtree_value <= n.subtree_value:
-                n.parent.subtree_value = n.subtree_value
-            else:
-                if n.parent.parent == None:
+        d_sum = subtree._subtree_sum
+        d_size = subtree._subtree_size
+        for n in old_path:
+            n._subtree_sum -= d_sum
+            n._subtree_size -= d_size
+        for n in new_path:
+            n._subtree_sum += d_sum
+            n._subtree_size += d_size
+
+        # The new side only gains, so its walk stops at the common ancestor,
+        # whose value already covers the subtree. The old side then finds
+        # the common ancestor's value unchanged too.
+        new_parent.refresh_value()
+        old_parent.refresh_value()
+
+        if self._aggregates:
+            values = subtree.aggregates
+            self._aggregate_walk(new_parent, [
+                values[a.name] for a in self._aggregates], stop=lca)
+            self._aggregate_walk(old_parent, [
+                a.inverse(values[a.name]) if a.inverse is not None else None
+                for a in self._aggregates], stop=lca)
+
+    @staticmethod
+    def _meet(a, b):
+        """
+        Finds the lowest common ancestor of `a` and `b` by walking up from
+        both in turn, so the walk costs the distance from them to it rather
+        than the depth of the tree.
+        :return: (lca, path from `a`, path from `b`), each path going up to
+            but not including the lca.
+        """
+        seen_a = {a: 0}
+        seen_b = {b: 0}
+        path_a = [a]
+        path_b = [b]
+        while a not in seen_b and b not in seen_a:
+            if a.parent is None and b.parent is None:
+                raise ValueError("the nodes are not in the same tree")
+            if a.parent is not None:
+                a = a.parent
+                seen_a[a] = len(path_a)
+                path_a.append(a)
+            if b.parent is not None:
+                b = b.parent
+                seen_b[b] = len(path_b)
+                path_b.append(b)
+        lca = a if a in seen_b else b
+        return lca, path_a[:seen_a[lca]], path_b[:seen_b[lca]]
+
+    def set_key(self, node, value):
+        """
+        Changes the key of `node`. Sums change all the way up, but subtree
+        values (and aggregates without an inverse) are only recomputed until
+        one stays the same.
+        :param node: A node in the tree.
+        :param value: The new key.
+        """
+        self._jumps = None
+        self._set_key(node, value)
+        if self.log is not None:
+            self.log.set_key(node, value)
+
+    def _set_key(self, node, value):
+        """
+        Does the work of `set_key`.
+        """
+        if self.backend is not None:
+            self.backend.set_key(node, value)
+            return
+        if self._live_versions:
+            self._save_path(node)
+
+        if self._dirty is not None:
+            self._mark(node, value - node.key, 0)
+            node.key = value
+            return
+
+        node.set_key(value)
+        if self._aggregates:
+            old = dict(node.aggregates)
+            self._compute_aggregates(node)
+            self._aggregate_walk(node.parent, [
+                a.difference(node.aggregates[a.name], old[a.name])
+                if a.inverse is not None else None
+                for a in self._aggregates])
+
+    def is_ancestor(self, a, b):
+        """
+        Checks whether `a` is a proper ancestor of `b`, in O(log n).
+
+        Every node has an enter and an exit token in an Euler tour of the
+        tree, so `a` is an ancestor of `b` exactly when its tokens enclose
+        those of `b`. The tour is written out with one walk on first use,
+        and held in a balanced tree (see `eulertour.TourOrder`), so put,
+        flatten, swap and move keep it up to date by cutting and splicing
+        runs of it in O(log n), whatever the size of the subtrees.
+        :param a: A node in the tree.
+        :param b: A node in the tree.
+        :return: Boolean, True if `a` is above `b`.
+        """
+        if self.backend is not None:
+            return self.backend.is_ancestor(a, b)
+        return self._tour_order().is_ancestor(a, b)
+
+    def depth(self, node):
+        """
+        Returns the number of edges between `node` and the root.
+        """
+        return self._jump_entry(node)[0]
+
+    def kth_ancestor(self, node, k):
+        """
+        Returns the ancestor `k` levels above `node`, in O(log n).
+
+        Every node keeps a table of its ancestors 1, 2, 4, 8, ... levels up,
+        so any distance is covered by one jump per bit of `k`. The tables
+        are built on first use, extended by put, and dropped by swap and
+        flatten.
+        :param node: A node in the tree.
+        :param k: How many levels to go up.
+        :return: The ancestor, `node` itself for k = 0, or None if the tree
+            is not that deep.
+        """
+        if k < 0:
+            raise ValueError("k must not be negative")
+        depth, ups, _ = self._jump_entry(node)
+        if k > depth:
+            return None
+        jumps = self._jumps
+        j = 0
+        while k:
+            if k & 1:
+                node = ups[j]
+                ups = jumps[node][1]
+            k >>= 1
+            j += 1
+        return node
+
+    def path_max(self, node, ancestor):
+        """
+        Returns the largest key on the path from `node` up to `ancestor`,
+        both included, in O(log n).
+        :param node: A node in the tree.
+        :param ancestor: `node` or one of its ancestors.
+        """
+        depth, ups, maxima = self._jump_entry(node)
+        k = depth - self._jumps[ancestor][0]
+        if k < 0 or self.kth_ancestor(node, k) is not ancestor:
+            raise ValueError("{} is not above {}".format(ancestor.key,
+                                                         node.key))
+        jumps = self._jumps
+        best = ancestor.key
+        j = 0
+        while k:
+            if k & 1:
+                if maxima[j] > best:
+                    best = maxima[j]
+                node = ups[j]
+                _, ups, maxima = jumps[node]
+            k >>= 1
+            j += 1
+        return best
+
+    def _jump_entry(self, node):
+        """
+        Returns the jump tables of `node`, building them if needed.
+        """
+        if self._jumps is None:
+            self._jumps = {}
+            self._jump_tables(self.root)
+        return self._jumps[node]
+
+    def _jump_tables(self, top):
+        """
+        Fills in the jump tables of the nodes under `top`, whose ancestors
+        already have theirs. For each node, `ancestors[j]` is the node 2^j
+        levels up, and `maxima[j]` the largest key among the 2^j nodes from
+        the node itself up to (not including) that ancestor.
+        """
+        jumps = self._jumps
+        for n in self.iter_preorder(top):
+            p = n.parent
+            if p is None or n is self.root:
+                jumps[n] = (0, [], [])
+                continue
+
+            ups = [p]
+            maxima = [n.key]
+            j = 0
+            while True:
+                _, above, above_maxima = jumps[ups[j]]
+                if len(above) <= j:
                     break
+                ups.append(above[j])
+                maxima.append(max(maxima[j], above_maxima[j]))
+                j += 1
+            jumps[n] = (jumps[p][0] + 1, ups, maxima)
+
+    def _dfs_position(self, node):
+        """
+        Returns a number that orders the nodes of the tree in a DFS order:
+        every node comes before its descendants, and each subtree is one
+        run. It is not always `iter_preorder`, since unlinking a child moves
+        the last child into its place in `children`.
+        """
+        if self.backend is not None:
+            return self.backend.position(node)
+        return self._tour_order().position(node)
+
+    def _tour_order(self):
+        """
+        Returns the tour used by `is_ancestor`, writing it out if needed.
+        """
+        if self._order is None:
+            self._order = eulertour.TourOrder(self.root)
+        return self._order
+
+    def register_aggregate(self, aggregate):
+        """
+        Starts keeping `aggregate` for every node of the tree. It is filled
+        in with one pass over the tree, and after that put, flatten and swap
+        update all registered aggregates together in a single walk up the
+        tree.
+        :param aggregate: An `aggregates.Aggregate`.
+        """
+        if self.backend is not None:
+            raise ValueError("aggregates need the default backend")
+        if any(a.name == aggregate.name for a in self._aggregates):
+            raise ValueError("{} is already registered".format(aggregate.name))
+
+        self._aggregates.append(aggregate)
+        for n in self.iter_postorder():
+            if self._live_versions:
+                self._save(n)
+            if n.aggregates is None:
+                n.aggregates = {}
+            n.aggregates[aggregate.name] = aggregate.of_node(n)
+
+    def aggregate(self, node, name):
+        """
+        Returns the value of a registered aggregate for the subtree of
+        `node`.
+        :param node: The root of the subtree.
+        :param name: The name of the aggregate.
+        """
+        if self._lazy is not None and node in self._dirty:
+            self._clean(node)
+        return node.aggregates[name]
+
+    def top_k(self, node, k):
+        """
+        Returns the `k` largest keys in the subtree of `node`, largest first.
+
+        If an `aggregates.TopK` of at least `k` is registered, its value is
+        read in O(k). Otherwise the subtree is searched best first: nodes
+        wait in a heap by their subtree value, which bounds every key below
+        them, so only the paths down to the `k` largest keys are opened.
+        When `r` keys are still missing, only the `r` children of an opened
+        node with the largest subtree values can hold any of them, so at
+        most `r` are pushed; the others are only looked at once.
+        :param node: The root of the subtree.
+        :param k: How many keys to return.
+        :return: List of up to `k` keys.
+        """
+        if k <= 0:
+            return []
+        for a in self._aggregates:
+            if isinstance(a, aggregates.TopK) and a.k >= k:
+                return list(self.aggregate(node, a.name)[:k])
+
+        # Entries are (-bound, tie breaker, is a key, node). A key entry
+        # comes out once no subtree left can hold anything larger.
+        result = []
+        count = 0
+        heap = [(-node.subtree_value, count, False, node)]
+        while heap and len(result) < k:
+            _, _, is_key, n = heapq.heappop(heap)
+            if is_key:
+                result.append(n.key)
+                continue
+            count += 1
+            heapq.heappush(heap, (-n.key, count, True, n))
+            children = n.children
+            missing = k - len(result)
+            if len(children) > missing:
+                children = heapq.nlargest(
+                    missing, children, key=lambda c: c.subtree_value)
+            for c in children:
+                count += 1
+                heapq.heappush(heap, (-c.subtree_value, count, False, c))
+        return result
+
+    def _compute_aggregates(self, n):
+        """
+        Recomputes every registered aggregate of `n` from its key and its
+        children.
+        """
+        if n.aggregates is None:
+            n.aggregates = {}
+        for a in self._aggregates:
+            n.aggregates[a.name] = a.of_node(n)
+
+    def _aggregate_walk(self, n, changes, stop=None):
+        """
+        Walks up from `n`, updating every registered aggregate at once.
+        An aggregate with an entry in `changes` has it combined into its
+        value at each node, in O(1) (or O(k) for `aggregates.TopK`): this
+        is its difference for aggregates with an inverse, and for any
+        aggregate the value of a subtree that was only added below `n`.
+        Aggregates without an entry are recomputed from the children. Each
+        aggregate stops once its value stays the same, since the values
+        above are then unchanged too, and the walk ends when all have.
+        :param n: The first node to update.
+        :param changes: For each aggregate, the value to combine in, or
+            None to recompute it.
+        :param stop: An ancestor of `n` where the walk ends, if it gets
+            there, without updating it.
+        """
+        aggs = self._aggregates
+        live = [True] * len(aggs)
+        while n is not None and n is not stop:
+            values = n.aggregates
+            changed = False
+            for i, a in enumerate(aggs):
+                if not live[i]:
+                    continue
+                if changes[i] is None:
+                    new = a.of_node(n)
+                else:
+                    new = a.combine(values[a.name], changes[i])
+                if new != values[a.name]:
+                    values[a.name] = new
+                    changed = True
                 else:
-                    if n.parent.subtree_value != n.parent.key:
-                        if n.parent.key < n.subtree_value:
-                            n.parent.subtree_value = n.subtree_value
-                        else:
-                            n.parent.subtree_value = n.parent.key
+                    live[i] = False
+            if not changed:
+                return
+            n = n.parent
+
+    @contextmanager
+    def batch(self):
+        """
+        Within the `with` block, put, flatten and swap only link the nodes
+        and mark the changed nodes dirty. When the block exits, every dirty
+        node is recomputed once, from the bottom up, so a burst of changes
+        under the same ancestors walks the shared path only once.
+
+        Subtree values read inside the block may be out of date. With the
+        Euler tour backend updates are already cheap and applied at once, and
+        a lazy tree already defers everything, so there it does nothing.
+
+        Usage:
+            with tree.batch():
+                for parent, child in pairs:
+                    tree.put(parent, child)
+        """
+        if self.backend is not None or self._lazy is not None:
+            yield self
+            return
+
+        if self._batch_depth == 0:
+            self._dirty = {}
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                dirty = self._dirty
+                for n in [n for n in dirty if n.parent not in dirty]:
+                    self._clean(n)
+                self._dirty = None
+
+    def _adopt(self, top):
+        """
+        Points every node under `top` at this lazy tree, so that reading
+        their values cleans them first.
+        """
+        for n in self.iter_subtree(top):
+            n.backend = self._lazy
+
+    def _add(self, parent, child):
+        """
+        Adds `child` below `parent`, now or deferred when batching.
+        """
+        if self._dirty is None:
+            parent.add_child(child)
+            if self._aggregates:
+                # The subtree of `parent` only gains the child's, so every
+                # aggregate just combines it in.
+                values = child.aggregates
+                self._aggregate_walk(parent, [
+                    values[a.name] for a in self._aggregates])
+            return
+
+        parent.link_child(child)
+        if parent.child_values is not None:
+            parent.child_values.add(child._subtree_value)
+        self._mark(parent, child._subtree_sum, child._subtree_size)
+        if child in self._dirty:
+            self._dirty[parent][2].add(child)
+
+    def _remove(self, parent, child):
+        """
+        Removes `child` from `parent`, now or deferred when batching.
+        """
+        if self._dirty is None:
+            parent.remove_child(child)
+            if self._aggregates:
+                self._aggregate_walk(parent, [
+                    a.inverse(child.aggregates[a.name])
+                    if a.inverse is not None else None
+                    for a in self._aggregates])
+            return
+
+        parent.unlink_child(child)
+        if parent.child_values is not None:
+            parent.child_values.remove(child._subtree_value)
+        self._mark(parent, -child._subtree_sum, -child._subtree_size)
+        self._dirty[parent][2].discard(child)
+
+    def _mark(self, n, d_sum, d_size):
+        """
+        Records that the subtree of `n` changed by `d_sum` and `d_size`, and
+        marks `n` and its ancestors dirty, stopping at the first one that
+        already is.
+        """
+        dirty = self._dirty
+        entry = dirty.get(n)
+        if entry is not None:
+            entry[0] += d_sum
+            entry[1] += d_size
+            return
+
+        dirty[n] = [d_sum, d_size, set()]
+        child = n
+        p = n.parent
+        while p is not None:
+            entry = dirty.get(p)
+            if entry is not None:
+                entry[2].add(child)
+                return
+            dirty[p] = [0, 0, {child}]
+            child = p
+            p = p.parent
+
+    def _clean(self, top):
+        """
+        Recomputes every dirty node in the subtree of `top`, children before
+        parents, and passes the changes of `top` on to its parent.
+        """
+        dirty = self._dirty
+        stack = [(top, False)]
+        while stack:
+            n, done = stack.pop()
+            if not done:
+                stack.append((n, True))
+                for c in dirty[n][2]:
+                    stack.append((c, False))
+                continue
+
+            d_sum, d_size, _ = dirty.pop(n)
+            n._subtree_sum += d_sum
+            n._subtree_size += d_size
+            old = n._subtree_value
+            new = n.key
+            m = n.child_max()
+            if m is not None and m > new:
+                new = m
+            n._subtree_value = new
+            if self._aggregates:
+                self._compute_aggregates(n)
+
+            p = n.parent
+            if p is None:
+                continue
+            if p.child_values is not None:
+                p.child_values.replace(old, new)
+            entry = dirty.get(p)
+            if entry is not None:
+                entry[0] += d_sum
+                entry[1] += d_size
+                entry[2].discard(n)
+
+
+class LazyValues:
+    """
+    LazyValues Class
+    Set as the `backend` of every node in a lazy tree. Before a subtree
+    value, sum or size is returned, any dirty nodes below it are recomputed.
+    """
+
+    def __init__(self, tree):
+        """
+        :param tree: The lazy tree.
+        """
+        self.tree = tree
+
+    def _settle(self, node):
+        if node in self.tree._dirty:
+            self.tree._clean(node)
+
+    def set_key(self, node, value):
+        self.tree.set_key(node, value)
+
+    def subtree_value(self, node):
+        self._settle(node)
+        return node._subtree_value
+
+    def subtree_sum(self, node):
+        self._settle(node)
+        return node._subtree_sum
 
-            n = n.parent
\ No newline at end of file
+    def subtree_size(self, node):
+        self._settle(node)
+        return node._subtree_size
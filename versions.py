@@ -0,0 +1,133 @@
+"""
+Tree Versions
+-------------
+
+Read-only views of a `tree.Tree` as it was at some point, taken in O(1)
+with `Tree.snapshot()` while the tree itself keeps changing.
+
+Nothing is copied when a version is taken. Instead, while any version is
+alive, the first time put, flatten or swap changes a node after a version
+was taken, the node's old fields (key, parent, children, subtree value, sum
+and size, aggregates) are saved in its `history`, tagged with the number of
+the first version that no longer sees them. Every change already walks the
+path from the changed node to the root, so only the nodes on that path are
+saved, each at most once per version.
+
+A version reads a node from the first history entry tagged after it, or
+from the node itself if there is none. Once released, a version can no
+longer be read, and history that no live version needs is dropped.
+
+Usage:
+    version = tree.snapshot()
+    tree.put(node, child)
+    version.subtree_value(version.root)   # as before the put
+    version.release()
+"""
+
+# Positions of the fields in a saved state.
+KEY, PARENT, CHILDREN, VALUE, SUM, SIZE, AGGREGATES = range(7)
+
+
+def state_of(node):
+    """
+    Returns the fields of `node` that versions can read, as a tuple.
+    """
+    aggregates = node.aggregates
+    return (node.key, node.parent, tuple(node.children), node._subtree_value,
+            node._subtree_sum, node._subtree_size,
+            dict(aggregates) if aggregates is not None else None)
+
+
+class Version:
+    """
+    Version Class
+    A read-only view of a tree at the time it was taken. Nodes are passed in
+    as the `node.Node` objects of the tree.
+
+    - key(node), parent(node), children(node)
+    - subtree_value(node), subtree_sum(node), subtree_size(node)
+    - aggregate(node, name)
+    - iter_preorder(node=None): Walks the tree as it was.
+    - release(): Frees the history kept for this version.
+    """
+
+    def __init__(self, tree, number):
+        """
+        :param tree: The `tree.Tree` this is a version of.
+        :param number: The number of this version.
+        """
+        self.tree = tree
+        self.number = number
+        self.root = tree.root
+        self.released = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _state(self, node):
+        """
+        Returns the saved state of `node` for this version, or None if the
+        node has not changed since.
+        """
+        if self.released:
+            raise ValueError("version {} was released".format(self.number))
+        history = node.history
+        if history is not None:
+            for number, state in history:
+                if number > self.number:
+                    return state
+        return None
+
+    def key(self, node):
+        state = self._state(node)
+        return node.key if state is None else state[KEY]
+
+    def parent(self, node):
+        state = self._state(node)
+        return node.parent if state is None else state[PARENT]
+
+    def children(self, node):
+        state = self._state(node)
+        return list(node.children if state is None else state[CHILDREN])
+
+    def subtree_value(self, node):
+        state = self._state(node)
+        return node._subtree_value if state is None else state[VALUE]
+
+    def subtree_sum(self, node):
+        state = self._state(node)
+        return node._subtree_sum if state is None else state[SUM]
+
+    def subtree_size(self, node):
+        state = self._state(node)
+        return node._subtree_size if state is None else state[SIZE]
+
+    def aggregate(self, node, name):
+        state = self._state(node)
+        aggregates = node.aggregates if state is None else state[AGGREGATES]
+        if aggregates is None or name not in aggregates:
+            raise KeyError(name)
+        return aggregates[name]
+
+    def iter_preorder(self, node=None):
+        """
+        Yields the nodes under `node` (the root by default) as they were,
+        in preorder.
+        """
+        stack = [self.root if node is None else node]
+        while stack:
+            n = stack.pop()
+            yield n
+            stack.extend(reversed(self.children(n)))
+
+    def release(self):
+        """
+        Lets the tree drop the history kept for this version. Does nothing
+        if it was already released.
+        """
+        if not self.released:
+            self.released = True
+            self.tree._release_version(self.number)